@@ -11,13 +11,64 @@ import plotly.subplots as sp
 from plotly.colors import qualitative
 from datetime import datetime
 from sklearn.ensemble import IsolationForest
-from sklearn.cluster import KMeans
+from sklearn.cluster import KMeans, MiniBatchKMeans
 from sklearn.preprocessing import StandardScaler
 import warnings
 import re
 import io
+import hashlib
+import ipaddress
+import os
+import threading
+from collections import OrderedDict
+import tempfile
+import time
+import gzip
+import glob
+import shutil
+import pickle
+import pyarrow as pa
+import pyarrow.feather as feather
+import pyarrow.parquet as pq
+from joblib import Parallel, delayed
+from feature_store import IPFeatureStore, WINDOWS
+from sketches import HyperLogLog, CountMinTopK
+from log_parser import (
+    parse_log_stream, parse_log_file_parallel, concat_categorical_frames,
+    file_compression, decompress_stream, read_source_files, iter_source_chunks, parse_log_text, LogTailer,
+    PARALLEL_PARSE_MIN_BYTES, LOG_FIELDS, COMPRESSION_EXTENSIONS, NDJSON_CHUNK_ROWS, STREAMABLE_READERS
+)
 warnings.filterwarnings('ignore')
 
+# Límite de memoria para la caché de datasets preprocesados (compartida entre sesiones)
+PROCESSED_CACHE_MAX_BYTES = 2 * 1024 ** 3
+
+# Caché en disco de datasets preprocesados (se puede cambiar con DGIPSE_CACHE_DIR)
+DISK_CACHE_DIR = os.environ.get(
+    'DGIPSE_CACHE_DIR',
+    os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), '.cache', 'procesados')
+)
+DISK_CACHE_MAX_BYTES = 20 * 1024 ** 3
+DISK_CACHE_MAX_AGE_DAYS = 30
+# Versión del preprocesamiento: subirla al cambiar columnas, dtypes o reglas de
+# clasificación deja sin efecto los datasets ya guardados en disco
+CACHE_VERSION = 2
+
+# Única carpeta del servidor que se puede leer desde el modo "Carpeta local" y el modo en
+# vivo. El dashboard queda expuesto en la red, así que sin DGIPSE_LOG_ROOT ambos se deshabilitan
+LOG_ROOT = os.environ.get('DGIPSE_LOG_ROOT')
+LOG_ROOT_DISABLED = (
+    "La lectura de archivos del servidor está deshabilitada. Definí la variable de entorno "
+    "DGIPSE_LOG_ROOT con la carpeta de logs que se puede consultar (p. ej. /var/log/nginx)."
+)
+
+# Tabla local de rangos IP -> país (CSV con columnas: red en notación CIDR, pais)
+IP_RANGES_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data', 'ip_ranges.csv')
+UNKNOWN_COUNTRY = 'Otros Países'
+
+# Lista local de firmas de user agents de bots (una por línea)
+BOT_SIGNATURES_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data', 'bot_signatures.txt')
+
 # ==========================================================
 # FUNCIONES AUXILIARES GLOBALES
 # ==========================================================
@@ -51,116 +102,1340 @@ def generate_executive_report(metricas, features, df_processed):
     """
     return report.encode('utf-8')
 
-def parse_log_line(line):
-    """Parsea una línea de log en formato común (Apache/Nginx)"""
-    # Patrón para logs Apache/NGINX común
-    pattern = r'(\S+) - - \[(.*?)\] "(\S+) (\S+) \S+" (\d+) (\d+) "([^"]*)" "([^"]*)"'
-    match = re.match(pattern, line)
-    
-    if match:
-        ip = match.group(1)
-        timestamp = match.group(2)
-        method = match.group(3)
-        url = match.group(4)
-        status = match.group(5)
-        size = match.group(6)
-        referer = match.group(7)
-        user_agent = match.group(8)
-        
-        return {
-            'IP': ip,
-            'fecha': timestamp,
-            'url': url,
-            'user_agent': user_agent
-        }
-    return None
-
-def extract_browser(user_agent):
-    browsers = {
-        'Chrome': 'Chrome',
-        'Firefox': 'Firefox', 
-        'Safari': 'Safari',
-        'Edge': 'Edge',
-        'Opera': 'Opera'
-    }
-    for key, value in browsers.items():
-        if key in user_agent:
-            return value
-    return 'Otros'
-
-def extract_os(user_agent):
-    os_list = {
-        'Windows': 'Windows',
-        'Mac': 'Mac',
-        'Linux': 'Linux',
-        'Android': 'Android',
-        'iOS': 'iOS'
-    }
-    for key, value in os_list.items():
-        if key in user_agent:
-            return value
-    return 'Otros'
-
-def extract_device(user_agent):
-    mobile_indicators = ['Mobile', 'Android', 'iPhone', 'iPad']
-    if any(indicator in user_agent for indicator in mobile_indicators):
-        return 'Móvil'
-    return 'Desktop'
-
-def geolocate_ip(ip):
-    ip_ranges = {
-        '200.81': 'Argentina',
-        '190.': 'Chile',
-        '181.': 'Chile', 
-        '200.1': 'Brasil',
-        '186.': 'Colombia',
-        '200.32': 'Uruguay',
-        '200.3': 'Paraguay',
-        '192.168.': 'Red Local',
-        '203.0.113.': 'Ejemplo',
-        '198.51.100.': 'Ejemplo'
-    }
-    for prefix, country in ip_ranges.items():
-        if ip.startswith(prefix):
-            return country
-    return 'Otros Países'
+# Tokens buscados en el user agent, en orden de prioridad (gana el primero que aparece)
+BROWSER_TOKENS = [
+    ('Chrome', 'Chrome'),
+    ('Firefox', 'Firefox'),
+    ('Safari', 'Safari'),
+    ('Edge', 'Edge'),
+    ('Opera', 'Opera')
+]
+
+OS_TOKENS = [
+    ('Windows', 'Windows'),
+    ('Mac', 'Mac'),
+    ('Linux', 'Linux'),
+    ('Android', 'Android'),
+    ('iOS', 'iOS')
+]
+
+MOBILE_INDICATORS = ['Mobile', 'Android', 'iPhone', 'iPad']
+
+UA_COLUMNS = ['navegador', 'sistema_operativo', 'dispositivo']
+UA_DEFAULT_LABELS = ('Otros', 'Otros', 'Desktop')
+
+def classify_user_agent(user_agent):
+    """Clasifica un user agent en (navegador, sistema operativo, dispositivo) en una sola pasada"""
+    browser = next((label for token, label in BROWSER_TOKENS if token in user_agent), 'Otros')
+    os_name = next((label for token, label in OS_TOKENS if token in user_agent), 'Otros')
+    device = 'Móvil' if any(indicator in user_agent for indicator in MOBILE_INDICATORS) else 'Desktop'
+    return browser, os_name, device
+
+def classify_user_agents(user_agents):
+    """Clasifica una serie de user agents trabajando sólo sobre los valores únicos.
+
+    Devuelve un dict columna -> Categorical alineado posicionalmente con la serie.
+    """
+    codes, uniques = pd.factorize(user_agents)
+    labels = [classify_user_agent(ua) for ua in uniques]
+    # Los user agents vacíos (código -1) se mapean a la etiqueta por defecto
+    if (codes == -1).any():
+        labels.append(UA_DEFAULT_LABELS)
+        codes = np.where(codes == -1, len(uniques), codes)
+
+    result = {}
+    for i, column in enumerate(UA_COLUMNS):
+        label_codes, categories = pd.factorize(np.array([label[i] for label in labels], dtype=object))
+        result[column] = pd.Categorical.from_codes(label_codes[codes], categories=categories)
+    return result
+
+def ipv4_to_int(ips):
+    """Convierte direcciones IPv4 en texto a enteros (vectorizado); -1 para valores no IPv4"""
+    parts = pd.Series(ips, dtype=object).str.split('.', expand=True)
+    if parts.shape[1] < 4:
+        return np.full(len(parts), -1, dtype=np.int64)
+    octets = parts.iloc[:, :4].apply(pd.to_numeric, errors='coerce')
+    valid = octets.notna().all(axis=1) & (octets >= 0).all(axis=1)
+    if parts.shape[1] > 4:
+        valid &= parts.iloc[:, 4:].isna().all(axis=1)
+    # Los octetos fuera de rango (p. ej. datos de ejemplo como 190.123.456.78) se recortan
+    # a 255 para conservar la coincidencia por los octetos superiores
+    values = octets.clip(upper=255).fillna(0).astype(np.int64).to_numpy()
+    result = (values[:, 0] << 24) | (values[:, 1] << 16) | (values[:, 2] << 8) | values[:, 3]
+    result[~valid.to_numpy()] = -1
+    return result
 
-def preprocess_data(df, file_type, log_format):
+class IPRangeIndex:
+    """Índice de rangos IPv4 -> país con búsqueda binaria vectorizada.
+
+    Los rangos se aplanan en intervalos disjuntos donde gana el rango más específico,
+    así que el resultado no depende del orden de las filas en la tabla.
+    """
+
+    def __init__(self, starts, ends, countries):
+        starts = np.asarray(starts, dtype=np.int64)
+        ends = np.asarray(ends, dtype=np.int64)
+        country_codes, self.countries = pd.factorize(pd.Series(countries, dtype=object))
+
+        # Límites de los intervalos elementales: cada inicio y cada fin + 1
+        self.bounds = np.unique(np.concatenate([starts, ends + 1]))
+        self.interval_codes = np.full(len(self.bounds), -1, dtype=np.int32)
+        # Pintar del rango más amplio al más específico para que este último prevalezca
+        for i in np.argsort(starts - ends, kind='stable'):
+            lo = np.searchsorted(self.bounds, starts[i])
+            hi = np.searchsorted(self.bounds, ends[i] + 1)
+            self.interval_codes[lo:hi] = country_codes[i]
+
+    @classmethod
+    def from_csv(cls, path):
+        table = pd.read_csv(path, dtype=str).dropna(subset=['red', 'pais'])
+        starts, ends, countries = [], [], []
+        for network, country in zip(table['red'], table['pais']):
+            net = ipaddress.ip_network(network.strip(), strict=False)
+            if net.version != 4:
+                continue
+            starts.append(int(net.network_address))
+            ends.append(int(net.broadcast_address))
+            countries.append(country.strip())
+        return cls(starts, ends, countries)
+
+    def lookup_codes(self, ip_ints):
+        """Devuelve el código de país de cada entero IPv4 (-1 si no está en ningún rango)"""
+        ip_ints = np.asarray(ip_ints, dtype=np.int64)
+        if len(self.bounds) == 0:
+            return np.full(len(ip_ints), -1, dtype=np.int32)
+        pos = np.searchsorted(self.bounds, ip_ints, side='right') - 1
+        codes = self.interval_codes[np.clip(pos, 0, None)]
+        codes[(pos < 0) | (ip_ints < 0)] = -1
+        return codes
+
+@st.cache_resource
+def load_ip_index(path, mtime):
+    """Carga (una vez por versión del archivo) el índice de rangos IP"""
+    return IPRangeIndex.from_csv(path)
+
+def get_ip_index():
+    if not os.path.exists(IP_RANGES_PATH):
+        st.warning(f"No se encontró la tabla de rangos IP ({IP_RANGES_PATH}); se usará '{UNKNOWN_COUNTRY}'")
+        return IPRangeIndex([], [], [])
+    return load_ip_index(IP_RANGES_PATH, os.path.getmtime(IP_RANGES_PATH))
+
+def ip_ranges_version():
+    """Fecha de modificación de la tabla de rangos IP (None si no existe), para las claves de caché"""
+    return os.path.getmtime(IP_RANGES_PATH) if os.path.exists(IP_RANGES_PATH) else None
+
+def geolocate_ips(ips, ip_index):
+    """Geolocaliza una serie de IPs consultando el índice sólo con los valores únicos"""
+    codes, uniques = pd.factorize(ips)
+    country_codes = ip_index.lookup_codes(ipv4_to_int(uniques))
+    categories = list(ip_index.countries) + [UNKNOWN_COUNTRY]
+    country_codes = np.where(country_codes == -1, len(categories) - 1, country_codes)
+    if (codes == -1).any():
+        country_codes = np.append(country_codes, len(categories) - 1)
+        codes = np.where(codes == -1, len(uniques), codes)
+    paises = pd.Categorical.from_codes(country_codes[codes], categories=categories)
+    return paises.remove_unused_categories()
+
+# Formatos de fecha candidatos para la detección automática (se prueban en este orden)
+TIMESTAMP_FORMATS = [
+    '%d-%m-%Y %I:%M:%S%p',
+    '%d/%b/%Y:%H:%M:%S %z',
+    '%Y-%m-%d %H:%M:%S',
+    '%Y-%m-%dT%H:%M:%S',
+    '%Y-%m-%dT%H:%M:%S%z',
+    '%Y-%m-%d %H:%M:%S.%f',
+    '%Y-%m-%dT%H:%M:%S.%f%z',
+    '%d/%m/%Y %H:%M:%S',
+    '%d-%m-%Y %H:%M:%S',
+    '%d/%m/%Y %H:%M',
+    '%m/%d/%Y %H:%M:%S'
+]
+TIMESTAMP_SAMPLE_SIZE = 1000
+TIMESTAMP_MIN_MATCH = 0.9
+# Las fechas con zona horaria (p. ej. el %z de Apache) se normalizan a esta zona
+LOCAL_TIMEZONE = 'America/Argentina/Buenos_Aires'
+
+def detect_timestamp_format(sample):
+    """Elige el formato que parsea la mayor parte de la muestra (None si ninguno alcanza)"""
+    best_format, best_ratio = None, 0.0
+    for fmt in TIMESTAMP_FORMATS:
+        ratio = pd.to_datetime(sample, format=fmt, errors='coerce', utc=True).notna().mean()
+        if ratio > best_ratio:
+            best_format, best_ratio = fmt, ratio
+        if ratio >= TIMESTAMP_MIN_MATCH:
+            break
+    return best_format if best_ratio >= TIMESTAMP_MIN_MATCH else None
+
+def parse_timestamps(values, preferred_format=None):
+    """Convierte una serie de fechas a datetime64 (hora local, sin zona) parseando sólo los valores únicos.
+
+    Con `preferred_format` (JSON y Apache) se parsea siempre con ese formato y los valores
+    que no coinciden quedan como NaT. Sin formato se detecta uno sobre una muestra; si
+    ninguno coincide se usa la inferencia elemento a elemento de pandas.
+    """
+    values = pd.Series(values)
+    if pd.api.types.is_datetime64_any_dtype(values.dtype):
+        parsed = values
+        if parsed.dt.tz is not None:
+            parsed = parsed.dt.tz_convert(LOCAL_TIMEZONE).dt.tz_localize(None)
+        return parsed
+
+    codes, uniques = pd.factorize(values)
+    uniques = pd.Series(uniques, dtype=object).astype(str).str.strip()
+    fmt = preferred_format or detect_timestamp_format(uniques.iloc[:TIMESTAMP_SAMPLE_SIZE])
+    has_offsets = fmt is not None and '%z' in fmt
+    try:
+        # utc=True unifica offsets distintos (p. ej. cambios de horario) en una sola columna
+        parsed = pd.to_datetime(uniques, format=fmt or 'mixed', errors='coerce', utc=has_offsets)
+    except ValueError:
+        # Mezcla de fechas con y sin zona horaria en la inferencia genérica
+        parsed = pd.to_datetime(uniques, format='mixed', errors='coerce', utc=True)
+    if parsed.dtype == object:
+        parsed = pd.to_datetime(parsed, errors='coerce', utc=True)
+    if parsed.dt.tz is not None:
+        parsed = parsed.dt.tz_convert(LOCAL_TIMEZONE).dt.tz_localize(None)
+
+    # Los valores vacíos (código -1) quedan como NaT
+    lookup = np.append(parsed.to_numpy(dtype='datetime64[ns]'), np.datetime64('NaT', 'ns'))
+    return pd.Series(lookup[codes], index=values.index)
+
+# Extensiones de recursos estáticos, comparadas contra la extensión final del path
+STATIC_EXTENSIONS = ['.css', '.js', '.jpg', '.jpeg', '.png', '.gif', '.ico', '.svg', '.woff', '.woff2', '.ttf']
+
+def normalize_urls(urls):
+    """Quita query string y fragmento de cada URL y las interna como categórica.
+
+    Se trabaja sobre los valores únicos: cada path distinto se procesa una sola vez
+    y el resultado se reparte a las filas a través de los códigos.
+    """
+    if isinstance(urls.dtype, pd.CategoricalDtype):
+        codes, uniques = urls.cat.codes.to_numpy(), urls.cat.categories
+    else:
+        codes, uniques = pd.factorize(urls)
+    paths = pd.Series(uniques, dtype=object).astype(str).str.replace(r'[?#].*$', '', regex=True)
+    # URLs que sólo difieren en la query string comparten el mismo path
+    path_codes, path_uniques = pd.factorize(paths)
+    path_codes = np.append(path_codes, -1)
+    return pd.Series(
+        pd.Categorical.from_codes(path_codes[codes], categories=path_uniques),
+        index=urls.index
+    )
+
+def classify_static_urls(paths):
+    """Marca como estáticos los paths cuya extensión final es de un recurso estático"""
+    categories = pd.Series(paths.cat.categories, dtype=object)
+    extensions = categories.str.lower().str.extract(r'(\.[a-z0-9]+)$', expand=False)
+    is_static = np.append(extensions.isin(STATIC_EXTENSIONS).to_numpy(), False)
+    return pd.Series(is_static[paths.cat.codes.to_numpy()], index=paths.index)
+
+DAY_NAMES = ['Monday', 'Tuesday', 'Wednesday', 'Thursday', 'Friday', 'Saturday', 'Sunday']
+MONTH_NAMES = ['January', 'February', 'March', 'April', 'May', 'June',
+               'July', 'August', 'September', 'October', 'November', 'December']
+
+# Columnas de texto con pocos valores distintos que se guardan como categóricas
+CATEGORICAL_COLUMNS = ['IP', 'user_agent', 'navegador', 'sistema_operativo', 'dispositivo', 'pais', 'archivo']
+
+def compact_dtypes(df):
+    """Convierte las columnas de baja cardinalidad a categóricas para reducir memoria"""
+    for column in CATEGORICAL_COLUMNS:
+        if column in df.columns and not isinstance(df[column].dtype, pd.CategoricalDtype):
+            df[column] = df[column].astype('category')
+    return df
+
+def preprocess_data(df, file_type, log_format, report_invalid=True):
     """Preprocesa los datos según el tipo de archivo y formato"""
     try:
         if file_type == "JSON":
             # Formato original para JSON
-            df['fecha'] = pd.to_datetime(df['fecha'], format='%d-%m-%Y %I:%M:%S%p', errors='coerce')
+            df['fecha'] = parse_timestamps(df['fecha'], preferred_format='%d-%m-%Y %I:%M:%S%p')
         elif log_format == "Log Apache/NGINX":
             # Formato para logs Apache
-            df['fecha'] = pd.to_datetime(df['fecha'], format='%d/%b/%Y:%H:%M:%S %z', errors='coerce')
+            df['fecha'] = parse_timestamps(df['fecha'], preferred_format='%d/%b/%Y:%H:%M:%S %z')
         else:
-            # Intentar formato genérico
-            df['fecha'] = pd.to_datetime(df['fecha'], errors='coerce')
+            # Detectar el formato automáticamente
+            df['fecha'] = parse_timestamps(df['fecha'])
         
         # Eliminar filas con fechas inválidas
         initial_count = len(df)
         df = df.dropna(subset=['fecha'])
-        if len(df) < initial_count:
+        if report_invalid and len(df) < initial_count:
             st.warning(f"Se eliminaron {initial_count - len(df)} registros con fechas inválidas")
         
         # Resto del procesamiento
-        df['navegador'] = df['user_agent'].apply(extract_browser)
-        df['sistema_operativo'] = df['user_agent'].apply(extract_os)
-        df['dispositivo'] = df['user_agent'].apply(extract_device)
-        static_extensions = ['.css', '.js', '.jpg', '.jpeg', '.png', '.gif', '.ico', '.svg', '.woff', '.ttf']
-        df['es_estatico'] = df['url'].str.contains('|'.join(static_extensions), case=False, na=False)
-        df['pais'] = df['IP'].apply(geolocate_ip)
-        df['hora'] = df['fecha'].dt.hour
-        df['dia_semana'] = df['fecha'].dt.day_name()
-        df['mes'] = df['fecha'].dt.month_name()
+        for column, values in classify_user_agents(df['user_agent']).items():
+            df[column] = values
+        df['url'] = normalize_urls(df['url'])
+        df['es_estatico'] = classify_static_urls(df['url'])
+        df['pais'] = geolocate_ips(df['IP'], get_ip_index())
+        df['hora'] = df['fecha'].dt.hour.astype(np.int8)
+        df['dia_semana'] = pd.Categorical.from_codes(df['fecha'].dt.dayofweek, categories=DAY_NAMES, ordered=True)
+        df['mes'] = pd.Categorical.from_codes(df['fecha'].dt.month - 1, categories=MONTH_NAMES, ordered=True)
         
-        return df
+        return compact_dtypes(df)
         
     except Exception as e:
         st.error(f"Error en preprocesamiento: {str(e)}")
         return df
 
+def value_range(values):
+    """(mínimo, máximo) de una columna; en categóricas se calcula sobre las categorías presentes"""
+    if isinstance(values.dtype, pd.CategoricalDtype):
+        values = pd.Series(values.cat.remove_unused_categories().cat.categories)
+    return values.min(), values.max()
+
+def describe_raw(df):
+    """Resumen de los datos crudos que se muestra en la vista previa (y se guarda en caché)"""
+    return {
+        'raw_preview': df.head(),
+        'raw_shape': df.shape,
+        'raw_memory': pd.DataFrame({
+            'tipo': df.dtypes.astype(str),
+            'memoria_MB': df.memory_usage(deep=True, index=False) / 1024 ** 2
+        }),
+        'raw_date_range': value_range(df['fecha']) if 'fecha' in df.columns else None
+    }
+
+def combine_raw_descriptions(descriptions):
+    """Combina los resúmenes de datos crudos de varios bloques leídos por separado"""
+    if not descriptions:
+        return describe_raw(pd.DataFrame())
+    memory = descriptions[0]['raw_memory'].copy()
+    memory['memoria_MB'] = sum(d['raw_memory']['memoria_MB'] for d in descriptions)
+    date_ranges = [d['raw_date_range'] for d in descriptions if d['raw_date_range'] is not None]
+    return {
+        'raw_preview': descriptions[0]['raw_preview'],
+        'raw_shape': (sum(d['raw_shape'][0] for d in descriptions), descriptions[0]['raw_shape'][1]),
+        'raw_memory': memory,
+        'raw_date_range': (
+            pd.Series([low for low, _ in date_ranges]).min(),
+            pd.Series([high for _, high in date_ranges]).max()
+        ) if date_ranges else None
+    }
+
+NDJSON_FORMAT = "NDJSON (un registro por línea)"
+
+def load_ndjson(stream, chunksize=NDJSON_CHUNK_ROWS):
+    """Lee un NDJSON por bloques de filas y preprocesa cada bloque por separado.
+
+    El archivo nunca se materializa completo como DataFrame crudo: la memoria pico
+    depende del tamaño del bloque y del resultado compacto acumulado.
+    Devuelve (df_processed, resumen de los datos crudos).
+    """
+    processed, descriptions = [], []
+    with pd.read_json(stream, lines=True, chunksize=chunksize) as reader:
+        for chunk in reader:
+            descriptions.append(describe_raw(chunk))
+            processed.append(preprocess_data(chunk, "JSON", NDJSON_FORMAT, report_invalid=False))
+    raw_info = combine_raw_descriptions(descriptions)
+    df_processed = concat_categorical_frames(processed)
+    dropped = raw_info['raw_shape'][0] - len(df_processed)
+    if dropped > 0:
+        st.warning(f"Se eliminaron {dropped} registros con fechas inválidas")
+    return df_processed, raw_info
+
+COMPRESSED_UPLOAD_TYPES = [extension.lstrip('.') for extension in COMPRESSION_EXTENSIONS]
+
+def base_upload_name(filename):
+    """Nombre del archivo sin la extensión de compresión (`access.log.gz` -> `access.log`)"""
+    return filename[:-len(os.path.splitext(filename)[1])] if file_compression(filename) else filename
+
+def open_upload(uploaded_file):
+    """Devuelve un lector binario del contenido de la subida, descomprimiendo al vuelo.
+
+    La descompresión es por streaming: los lectores consumen el archivo por bloques
+    y el contenido descomprimido nunca se guarda completo en memoria.
+    """
+    uploaded_file.seek(0)
+    return decompress_stream(uploaded_file, file_compression(uploaded_file.name))
+
+SOURCE_MODES = ["Subir archivos", "Carpeta local"]
+
+def natural_sort_key(path):
+    """Orden natural de nombres: access.log.2 va antes que access.log.10"""
+    return [int(part) if part.isdigit() else part for part in re.split(r'(\d+)', path)]
+
+def inside_log_root(path):
+    """Indica si la ruta, resolviendo symlinks y '..', queda dentro de LOG_ROOT"""
+    root = os.path.realpath(LOG_ROOT)
+    return os.path.commonpath([root, os.path.realpath(path)]) == root
+
+def resolve_log_path(path):
+    """Ruta absoluta (las relativas se toman desde LOG_ROOT), o None si queda fuera de LOG_ROOT"""
+    resolved = os.path.join(os.path.realpath(LOG_ROOT), os.path.expanduser(path))
+    return resolved if inside_log_root(resolved) else None
+
+def select_sources(upload_label, upload_types, upload_help, default_pattern):
+    """Selector de origen: uno o varios archivos subidos, o los archivos de una carpeta local.
+
+    Devuelve (archivos subidos, rutas locales).
+    """
+    source_mode = st.radio("Origen de los datos:", SOURCE_MODES, horizontal=True)
+    if source_mode == SOURCE_MODES[0]:
+        uploads = st.file_uploader(upload_label, type=upload_types, help=upload_help, accept_multiple_files=True)
+        return list(uploads or []), []
+
+    if not LOG_ROOT:
+        st.info(LOG_ROOT_DISABLED)
+        return [], []
+    folder = st.text_input("Carpeta", help=f"Ruta de una carpeta dentro de {LOG_ROOT} (absoluta o relativa a ella)")
+    pattern = st.text_input(
+        "Patrón de archivos", value=default_pattern,
+        help="Comodines estilo shell: `access.log*` incluye access.log, access.log.1 … access.log.30.gz"
+    )
+    if not folder:
+        return [], []
+    folder = resolve_log_path(folder)
+    if folder is None:
+        st.error(f"❌ Sólo se pueden leer carpetas dentro de {LOG_ROOT}")
+        return [], []
+    # El patrón también podría salir de la carpeta ('..', symlinks): se filtra cada resultado
+    paths = sorted(
+        (path for path in glob.glob(os.path.join(folder, pattern)) if os.path.isfile(path) and inside_log_root(path)),
+        key=natural_sort_key
+    )
+    if paths:
+        st.caption(f"📂 {len(paths)} archivos encontrados ({sum(os.path.getsize(path) for path in paths) / 1024 ** 2:,.1f} MB)")
+    else:
+        st.warning("No se encontraron archivos con ese patrón en la carpeta indicada")
+    return [], paths
+
+def compute_sources_key(uploads, paths, *options):
+    """Clave de caché para varios archivos: contenido de los subidos, tamaño y fecha de los locales"""
+    digest = hashlib.blake2b(digest_size=20)
+    for upload in uploads:
+        digest.update(upload.name.encode())
+        digest.update(hashlib.blake2b(upload.getbuffer(), digest_size=20).digest())
+    for path in paths:
+        stat = os.stat(path)
+        digest.update(f"{os.path.abspath(path)}:{stat.st_size}:{stat.st_mtime_ns}".encode())
+    return ':'.join([digest.hexdigest()] + [str(option) for option in options])
+
+def source_reader(file_type, log_format):
+    """Lector de log_parser que corresponde al tipo de archivo y formato elegidos"""
+    if file_type == "JSON":
+        return 'ndjson' if log_format == NDJSON_FORMAT else 'json'
+    return 'apache' if log_format == "Log Apache/NGINX" else 'csv'
+
+def load_multiple_sources(uploads, paths, reader, n_workers):
+    """Lee varios archivos en procesos paralelos y los une con la columna `archivo`.
+
+    Los archivos subidos se vuelcan primero a una carpeta temporal para que cada
+    proceso lea el suyo desde disco.
+    """
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        upload_paths = []
+        for i, upload in enumerate(uploads):
+            # Una subcarpeta por archivo evita pisar subidas con el mismo nombre
+            path = os.path.join(tmp_dir, str(i), upload.name)
+            os.makedirs(os.path.dirname(path))
+            with open(path, 'wb') as f:
+                f.write(upload.getbuffer())
+            upload_paths.append(path)
+        all_paths = upload_paths + list(paths)
+        names = [upload.name for upload in uploads] + [os.path.basename(path) for path in paths]
+        return read_source_files(all_paths, reader, n_workers, names=names)
+
+def compute_upload_key(data, *options):
+    """Clave de caché a partir del hash del contenido subido y de las opciones de lectura elegidas"""
+    digest = hashlib.blake2b(data, digest_size=20).hexdigest()
+    return ':'.join([digest] + [str(option) for option in options])
+
+REQUIRED_COLUMNS = ['fecha', 'IP', 'url', 'user_agent']
+# Campos opcionales que se conservan si el archivo los trae (los mismos del parser de logs)
+OPTIONAL_COLUMNS = [column for column in LOG_FIELDS if column not in REQUIRED_COLUMNS]
+
+def to_local_timestamp(value):
+    """Convierte una fecha (con o sin zona) a Timestamp local sin zona, para comparar con `fecha`"""
+    value = pd.Timestamp(value)
+    if value.tz is not None:
+        value = value.tz_convert(LOCAL_TIMEZONE).tz_localize(None)
+    return value
+
+def select_row_groups(parquet_file, column, date_range):
+    """Índices de los row groups cuyas estadísticas min/max de `column` se cruzan con el rango"""
+    metadata = parquet_file.metadata
+    column_index = metadata.schema.names.index(column)
+    start, end = date_range
+    selected = []
+    for i in range(metadata.num_row_groups):
+        stats = metadata.row_group(i).column(column_index).statistics
+        if stats is not None and stats.has_min_max:
+            if to_local_timestamp(stats.max) < start or to_local_timestamp(stats.min) >= end:
+                continue
+        selected.append(i)
+    return selected
+
+def dashboard_columns(schema):
+    """Columnas del archivo que usa el dashboard (las requeridas y las opcionales presentes)"""
+    return [column for column in REQUIRED_COLUMNS + OPTIONAL_COLUMNS if column in schema.names]
+
+def parquet_row_groups(parquet_file, date_range=None):
+    """Row groups a leer: todos, o sólo los que se cruzan con el rango si `fecha` es fecha/timestamp"""
+    schema = parquet_file.schema_arrow
+    if date_range is not None and 'fecha' in schema.names:
+        fecha_type = schema.field('fecha').type
+        if pa.types.is_timestamp(fecha_type) or pa.types.is_date(fecha_type):
+            return list(select_row_groups(parquet_file, 'fecha', date_range))
+    return list(range(parquet_file.metadata.num_row_groups))
+
+def read_columnar_upload(uploaded_file, date_range=None):
+    """Lee un Parquet/Feather/Arrow IPC subido, proyectando sólo las columnas que usa el dashboard.
+
+    En Parquet, si `fecha` es de tipo fecha/timestamp y hay un rango elegido, se descartan
+    los row groups que caen fuera del rango a partir de sus estadísticas.
+    """
+    source = pa.BufferReader(pa.py_buffer(uploaded_file.getbuffer()))
+    if uploaded_file.name.lower().endswith('.parquet'):
+        parquet_file = pq.ParquetFile(source)
+        columns = dashboard_columns(parquet_file.schema_arrow)
+        table = parquet_file.read_row_groups(parquet_row_groups(parquet_file, date_range), columns=columns)
+    else:
+        columns = dashboard_columns(pa.ipc.open_file(source).schema)
+        source.seek(0)
+        table = feather.read_table(source, columns=columns)
+    return table.to_pandas()
+
+def iter_columnar_chunks(uploaded_file, date_range=None, batch_size=NDJSON_CHUNK_ROWS):
+    """Recorre un Parquet/Feather/Arrow IPC subido por lotes de filas, con las mismas columnas
+    y row groups que read_columnar_upload, sin armar la tabla completa"""
+    source = pa.BufferReader(pa.py_buffer(uploaded_file.getbuffer()))
+    if uploaded_file.name.lower().endswith('.parquet'):
+        parquet_file = pq.ParquetFile(source)
+        batches = parquet_file.iter_batches(
+            batch_size=batch_size,
+            row_groups=parquet_row_groups(parquet_file, date_range),
+            columns=dashboard_columns(parquet_file.schema_arrow)
+        )
+    else:
+        reader = pa.ipc.open_file(source)
+        columns = dashboard_columns(reader.schema)
+        batches = (reader.get_batch(i).select(columns) for i in range(reader.num_record_batches))
+    for batch in batches:
+        yield batch.to_pandas()
+
+class ProcessedDataCache:
+    """Caché LRU de datasets preprocesados, acotada por memoria total en bytes"""
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()
+        self._sizes = {}
+        self._total_bytes = 0
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            if key not in self._entries:
+                return None
+            self._entries.move_to_end(key)
+            return self._entries[key]
+
+    def put(self, key, entry):
+        nbytes = int(entry['df_processed'].memory_usage(deep=True).sum())
+        if nbytes > self.max_bytes:
+            # No vale la pena cachear algo que desalojaría todo lo demás
+            return
+        with self._lock:
+            if key in self._entries:
+                self._total_bytes -= self._sizes.pop(key)
+                del self._entries[key]
+            self._entries[key] = entry
+            self._sizes[key] = nbytes
+            self._total_bytes += nbytes
+            # Desalojar los datasets usados hace más tiempo hasta volver al límite
+            while self._total_bytes > self.max_bytes:
+                old_key, _ = self._entries.popitem(last=False)
+                self._total_bytes -= self._sizes.pop(old_key)
+
+class DiskDatasetCache:
+    """Caché en disco de datasets preprocesados en formato Arrow IPC (Feather) sin comprimir.
+
+    Recargar un dataset evita volver a parsearlo y clasificarlo: el archivo se abre con
+    memory-map, pero el DataFrame resultante es una copia en memoria. Se desalojan por
+    antigüedad y por tamaño total, empezando por los usados hace más tiempo.
+    """
+
+    def __init__(self, directory, max_bytes, max_age_days):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.max_age_seconds = max_age_days * 24 * 3600
+        self._lock = threading.Lock()
+
+    def _paths(self, key):
+        name = hashlib.sha1(key.encode('utf-8')).hexdigest()
+        base = os.path.join(self.directory, name)
+        return base + '.arrow', base + '.meta.pkl'
+
+    def get(self, key):
+        data_path, meta_path = self._paths(key)
+        if not (os.path.exists(data_path) and os.path.exists(meta_path)):
+            return None
+        try:
+            table = feather.read_table(data_path, memory_map=True)
+            with open(meta_path, 'rb') as f:
+                entry = pickle.load(f)
+        except Exception:
+            return None
+        entry['df_processed'] = table.to_pandas()
+        # Actualizar la fecha de uso para que el desalojo sea LRU
+        os.utime(data_path)
+        os.utime(meta_path)
+        return entry
+
+    def put(self, key, entry):
+        os.makedirs(self.directory, exist_ok=True)
+        data_path, meta_path = self._paths(key)
+        df = entry['df_processed'].reset_index(drop=True)
+        # Escribir a un temporal y renombrar para no dejar archivos a medio escribir
+        feather.write_feather(df, data_path + '.tmp', compression='uncompressed')
+        os.replace(data_path + '.tmp', data_path)
+        with open(meta_path + '.tmp', 'wb') as f:
+            pickle.dump({k: v for k, v in entry.items() if k != 'df_processed'}, f)
+        os.replace(meta_path + '.tmp', meta_path)
+        self.evict()
+
+    def evict(self):
+        with self._lock:
+            if not os.path.isdir(self.directory):
+                return
+            now = time.time()
+            datasets = []
+            for name in os.listdir(self.directory):
+                if not name.endswith('.arrow'):
+                    continue
+                data_path = os.path.join(self.directory, name)
+                meta_path = data_path[:-len('.arrow')] + '.meta.pkl'
+                stat = os.stat(data_path)
+                datasets.append((stat.st_mtime, stat.st_size, data_path, meta_path))
+
+            datasets.sort()
+            total_bytes = sum(size for _, size, _, _ in datasets)
+            for mtime, size, data_path, meta_path in datasets:
+                if now - mtime <= self.max_age_seconds and total_bytes <= self.max_bytes:
+                    break
+                for path in (data_path, meta_path):
+                    if os.path.exists(path):
+                        os.remove(path)
+                total_bytes -= size
+
+@st.cache_resource
+def get_processed_cache():
+    """Instancia única de la caché, compartida por todas las sesiones del servidor"""
+    return ProcessedDataCache(PROCESSED_CACHE_MAX_BYTES)
+
+@st.cache_resource
+def get_disk_cache():
+    """Instancia única de la caché en disco, compartida por todas las sesiones del servidor"""
+    return DiskDatasetCache(DISK_CACHE_DIR, DISK_CACHE_MAX_BYTES, DISK_CACHE_MAX_AGE_DAYS)
+
+# Dimensiones del cubo de conteos que alimenta los gráficos del dashboard
+CUBE_DIMENSIONS = ['hora', 'dia_semana', 'dispositivo', 'navegador', 'pais', 'es_estatico']
+TOP_PAGES = 10
+
+@st.cache_data(max_entries=8, show_spinner=False)
+def build_aggregates(dataset_key, _df):
+    """Recorre el dataset una vez y arma el cubo de conteos más el top de páginas"""
+    cube = _df.groupby(CUBE_DIMENSIONS, observed=True, sort=False).size().rename('count').reset_index()
+    # url es categórica: value_counts cuenta por código e incluye paths sin visitas (conteo 0)
+    page_counts = _df.loc[~_df['es_estatico'], 'url'].value_counts()
+    top_pages = page_counts[page_counts > 0].head(TOP_PAGES)
+    return {'cube': cube, 'top_pages': top_pages}
+
+SKETCH_TOP_DIMENSIONS = ['navegador', 'pais']
+# Navegadores y países tienen pocos valores distintos: alcanza con un Count-Min más angosto
+SKETCH_SMALL_WIDTH = 2 ** 12
+
+def feed_sketches(summary, chunk):
+    """Suma un bloque ya preprocesado a los sketches del resumen; después el bloque se descarta"""
+    sketches = summary['sketches']
+    sketches['ips'].add(chunk['IP'])
+    # El hash de cada URL del bloque se calcula una vez y alimenta al HyperLogLog y al Count-Min
+    urls = chunk['url'].array
+    valid = urls.codes >= 0
+    codes, first, counts = np.unique(urls.codes[valid], return_index=True, return_counts=True)
+    keys = np.asarray(urls.categories.take(codes), dtype=object)
+    hashes = pd.util.hash_array(keys, categorize=False)
+    sketches['urls'].add_hashes(hashes)
+    # es_estatico depende sólo de la URL: alcanza con mirarlo en su primera aparición
+    pages = ~chunk['es_estatico'].to_numpy()[valid][first]
+    sketches['pages'].add_counts(keys[pages], counts[pages], hashes[pages])
+    for dimension in SKETCH_TOP_DIMENSIONS:
+        sketches[dimension].add(chunk[dimension])
+    summary['total_requests'] += len(chunk)
+    summary['mobile_requests'] += int((chunk['dispositivo'] == 'Móvil').sum())
+
+def iter_sketch_chunks(uploads, paths, file_type, log_format, date_range=None):
+    """Bloques de filas crudas de todos los archivos elegidos, leídos de a uno"""
+    if file_type == "Parquet/Arrow":
+        for upload in uploads:
+            yield from iter_columnar_chunks(upload, date_range)
+        return
+    reader = source_reader(file_type, log_format)
+    for upload in uploads:
+        yield from iter_source_chunks(open_upload(upload), reader)
+    for path in paths:
+        with open(path, 'rb') as f:
+            yield from iter_source_chunks(decompress_stream(f, file_compression(path)), reader)
+
+@st.cache_data(max_entries=8, show_spinner=False)
+def build_sketch_summary(dataset_key, _chunks, file_type, log_format, date_range):
+    """Lee los datos por bloques alimentando sólo los sketches, en memoria constante.
+
+    Cada bloque se preprocesa, se suma a los sketches y se descarta: nunca se arma
+    el dataset completo ni estado exacto por IP o por URL.
+    """
+    summary = {
+        'sketches': {
+            'ips': HyperLogLog(),
+            'urls': HyperLogLog(),
+            'pages': CountMinTopK(),
+            **{dimension: CountMinTopK(width=SKETCH_SMALL_WIDTH) for dimension in SKETCH_TOP_DIMENSIONS}
+        },
+        'raw_rows': 0,
+        'total_requests': 0,
+        'mobile_requests': 0
+    }
+    for chunk in _chunks:
+        missing_columns = [col for col in REQUIRED_COLUMNS if col not in chunk.columns]
+        if missing_columns:
+            raise ValueError(f"Faltan columnas requeridas: {missing_columns}")
+        summary['raw_rows'] += len(chunk)
+        chunk = preprocess_data(chunk, file_type, log_format, report_invalid=False)
+        if date_range is not None:
+            chunk = chunk[(chunk['fecha'] >= date_range[0]) & (chunk['fecha'] < date_range[1])]
+        if len(chunk) > 0:
+            feed_sketches(summary, chunk)
+    return summary
+
+def sketch_caption(sketches):
+    """Resumen de las estimaciones del modo aproximado con sus cotas de error"""
+    # La cota depende del total sumado a cada sketch: se informa la mayor
+    rankings = [sketches['pages']] + [sketches[dimension] for dimension in SKETCH_TOP_DIMENSIONS]
+    error_bound = max(sketch.error_bound for sketch in rankings)
+    return (
+        f"≈ Usuarios únicos y URLs distintas estimados con HyperLogLog "
+        f"(error estándar ±{sketches['ips'].relative_error:.1%}). "
+        f"Los rankings de páginas, navegadores y países usan Count-Min: cada conteo puede estar "
+        f"sobreestimado hasta en {error_bound:,.0f} requests con {rankings[0].confidence:.0%} de confianza. "
+        f"Total de requests y tráfico móvil son exactos."
+    )
+
+def sketch_top(sketches, dimension, n=None):
+    """Ranking estimado de una dimensión, con el mismo formato que cube_totals"""
+    sketch = sketches[dimension]
+    return sketch.top(n or sketch.capacity).rename_axis(dimension)
+
+def render_sketch_bar(totals, title, color):
+    """Gráfico de barras horizontales de un ranking estimado"""
+    fig = px.bar(
+        totals.rename('requests').reset_index(),
+        y=totals.index.name,
+        x='requests',
+        orientation='h',
+        title=title,
+        color_discrete_sequence=[color]
+    )
+    fig.update_layout(
+        height=400,
+        xaxis_title="Requests (estimado)",
+        yaxis_title="",
+        yaxis={'categoryorder': 'total ascending'},
+        plot_bgcolor='rgba(0,0,0,0)',
+        paper_bgcolor='rgba(0,0,0,0)',
+    )
+    fig.update_traces(hovertemplate="<b>%{y}</b><br>≈ %{x:,} requests<extra></extra>")
+    st.plotly_chart(fig, use_container_width=True)
+
+def render_sketch_summary(summary, source_name):
+    """Resumen reducido del modo aproximado: métricas y rankings estimados, sin modelos"""
+    sketches = summary['sketches']
+    total_requests = summary['total_requests']
+    st.success(f"✅ **{summary['raw_rows']:,} registros** leídos por bloques desde {source_name}")
+    if total_requests == 0:
+        st.error("❌ No hay datos válidos después del preprocesamiento. Verifica el formato de tu archivo.")
+        return
+
+    st.markdown("### ≈ Resumen aproximado")
+    col1, col2, col3, col4 = st.columns(4)
+    col1.metric("👥 Usuarios únicos (≈)", f"{sketches['ips'].estimate():,.0f}")
+    col2.metric("📨 Total requests", f"{total_requests:,}")
+    col3.metric("📱 Tráfico móvil", f"{summary['mobile_requests'] / total_requests * 100:.1f}%")
+    col4.metric("🔗 URLs distintas (≈)", f"{sketches['urls'].estimate():,.0f}")
+    st.caption(sketch_caption(sketches))
+
+    render_sketch_bar(
+        sketch_top(sketches, 'pages', TOP_PAGES).rename_axis('url'), "📄 Páginas más visitadas", '#667eea'
+    )
+    col_navegador, col_pais = st.columns(2)
+    with col_navegador:
+        render_sketch_bar(sketch_top(sketches, 'navegador', TOP_PAGES), "🌐 Navegadores", '#764ba2')
+    with col_pais:
+        render_sketch_bar(sketch_top(sketches, 'pais', TOP_PAGES), "🌎 Países", '#f093fb')
+    st.info(
+        "En modo aproximado no se arman las features por IP, la detección de bots y anomalías "
+        "ni los gráficos temporales: desmarcá la opción del sidebar para el análisis completo."
+    )
+
+def cube_totals(cube, dimensions):
+    """Suma los conteos del cubo agrupando por una o varias dimensiones"""
+    return cube.groupby(dimensions, observed=True)['count'].sum()
+
+def cube_top_label(cube, dimension):
+    """Valor más frecuente de una dimensión según el cubo ('N/A' si está vacío)"""
+    totals = cube_totals(cube, dimension)
+    return totals.idxmax() if len(totals) > 0 else 'N/A'
+
+FEATURE_COLUMNS = ['total_requests', 'unique_pages', 'unique_hours']
+SESSION_FEATURE_COLUMNS = ['avg_session_seconds', 'avg_session_depth', 'pages_per_session']
+# Features con las que se entrenan el IsolationForest y el KMeans del análisis completo
+MODEL_FEATURE_COLUMNS = FEATURE_COLUMNS + SESSION_FEATURE_COLUMNS
+
+# Inactividad (en minutos) a partir de la cual empieza una sesión nueva
+SESSION_GAP_MINUTES = 30
+
+def category_codes(values):
+    """Códigos enteros de una columna (categórica o no), para ordenar sin comparar strings"""
+    if isinstance(values.dtype, pd.CategoricalDtype):
+        return values.cat.codes.to_numpy(), values.cat.categories
+    return pd.factorize(values)
+
+def group_time_order(groups, times):
+    """Orden de filas por (grupo, segundo) para códigos de grupo y tiempos enteros"""
+    if len(times) == 0:
+        return np.zeros(0, dtype=np.int64)
+    time_offsets = times - times.min()
+    time_bits = int(time_offsets.max()).bit_length()
+    if int(groups.max()).bit_length() + time_bits <= 62:
+        # Clave única (grupo, segundo) en un int64: un solo argsort en vez de lexsort
+        return np.argsort((groups << time_bits) | time_offsets)
+    return np.lexsort((times, groups))
+
+def epoch_seconds(fechas):
+    """Segundos enteros desde epoch (los logs tienen resolución de segundos)"""
+    return fechas.to_numpy(dtype='datetime64[s]').astype(np.int64)
+
+def compute_sessions(df, gap_minutes=SESSION_GAP_MINUTES):
+    """Divide las requests en sesiones por (IP, user_agent) y corte por inactividad.
+
+    Se ordena una sola vez sobre arreglos de códigos enteros y los cortes salen de
+    diff/cumsum, sin loops por IP. Devuelve una fila por sesión.
+    """
+    ip_codes, ip_categories = category_codes(df['IP'])
+    ua_codes, ua_categories = category_codes(df['user_agent'])
+    times = epoch_seconds(df['fecha'])
+    groups = ip_codes.astype(np.int64) * (len(ua_categories) + 1) + (ua_codes.astype(np.int64) + 1)
+    del ua_codes
+
+    order = group_time_order(groups, times)
+    groups, times = groups[order], times[order]
+    ip_codes = ip_codes[order]
+    is_page = ~df['es_estatico'].to_numpy()[order]
+    del order
+
+    new_session = np.ones(len(times), dtype=bool)
+    new_session[1:] = (groups[1:] != groups[:-1]) | (np.diff(times) > gap_minutes * 60)
+    starts = np.flatnonzero(new_session)
+    ends = np.append(starts[1:], len(times)) - 1
+    del groups, new_session
+
+    return pd.DataFrame({
+        'IP': pd.Categorical.from_codes(ip_codes[starts], categories=ip_categories),
+        'inicio': pd.to_datetime(times[starts], unit='s'),
+        'duracion_s': times[ends] - times[starts],
+        'profundidad': ends - starts + 1,
+        'paginas': np.add.reduceat(is_page, starts) if len(starts) else np.zeros(0, dtype=np.int64)
+    })
+
+def session_features(sessions):
+    """Promedios por IP de duración, profundidad y páginas vistas por sesión"""
+    return sessions.groupby('IP', observed=True).agg(
+        avg_session_seconds=('duracion_s', 'mean'),
+        avg_session_depth=('profundidad', 'mean'),
+        pages_per_session=('paginas', 'mean')
+    )
+
+def summarize_sessions(sessions):
+    """Cantidad de sesiones y promedios generales que se muestran en el dashboard"""
+    return {
+        'sesiones': len(sessions),
+        'duracion_media_s': sessions['duracion_s'].mean(),
+        'profundidad_media': sessions['profundidad'].mean(),
+        'paginas_media': sessions['paginas'].mean()
+    }
+
+@st.cache_data(max_entries=8, show_spinner=False)
+def compute_session_stats(dataset_key, _df):
+    """Features de sesión por IP y resumen general del dataset.
+
+    Sólo se cachean estos resultados chicos: la tabla con una fila por sesión
+    se descarta apenas se agrega.
+    """
+    sessions = compute_sessions(_df)
+    return session_features(sessions), summarize_sessions(sessions)
+
+@st.cache_data(max_entries=8, show_spinner=False)
+def compute_ip_features(dataset_key, _df):
+    """Tabla de features por IP; se calcula una vez por dataset (identificado por dataset_key)"""
+    features = _df.groupby('IP', observed=True).agg({
+        'fecha': 'count',
+        'url': 'nunique',
+        'hora': 'nunique'
+    }).rename(columns={'fecha': 'total_requests', 'url': 'unique_pages', 'hora': 'unique_hours'})
+    return features.join(compute_session_stats(dataset_key, _df)[0])
+
+# Umbrales de comportamiento automatizado por IP
+BOT_MIN_REQUESTS = 20
+BOT_MAX_REQUESTS_PER_MINUTE = 60
+BOT_MAX_INTERARRIVAL_CV = 0.1
+# Tramo mínimo de actividad para juzgar la regularidad de los intervalos
+BOT_MIN_ACTIVE_SECONDS = 5 * 60
+# Fracción de requests con user agent de bot a partir de la cual se marca la IP
+BOT_UA_MIN_SHARE = 0.5
+
+@st.cache_resource(show_spinner=False)
+def load_bot_signatures(path, mtime):
+    """Compila (una vez por versión del archivo) las firmas en un único patrón de alternativas"""
+    with open(path, encoding='utf-8') as f:
+        signatures = {line.strip().lower() for line in f if line.strip() and not line.startswith('#')}
+    if not signatures:
+        return None
+    # Las firmas más largas primero, para que gane la coincidencia más específica
+    return re.compile('|'.join(re.escape(token) for token in sorted(signatures, key=len, reverse=True)), re.IGNORECASE)
+
+def get_bot_signatures():
+    if not os.path.exists(BOT_SIGNATURES_PATH):
+        st.warning(f"No se encontró la lista de firmas de bots ({BOT_SIGNATURES_PATH}); sólo se usará el comportamiento")
+        return None
+    return load_bot_signatures(BOT_SIGNATURES_PATH, os.path.getmtime(BOT_SIGNATURES_PATH))
+
+def match_bot_user_agents(user_agents, pattern):
+    """Indica por fila si el user agent coincide con alguna firma; se evalúa una vez por valor único"""
+    codes, uniques = category_codes(user_agents)
+    if pattern is None:
+        return np.zeros(len(codes), dtype=bool)
+    matches = np.fromiter(
+        (pattern.search(user_agent) is not None for user_agent in pd.Series(uniques, dtype=object).astype(str)),
+        dtype=bool, count=len(uniques)
+    )
+    return np.append(matches, False)[codes]
+
+def ip_rate_features(df):
+    """Tasa de requests e intervalos entre requests por IP, con un solo ordenamiento por (IP, fecha).
+
+    Sólo se cuentan las páginas: los recursos estáticos de una misma página llegan en ráfaga
+    y harían parecer automatizada cualquier visita normal.
+    """
+    ip_codes, ip_categories = category_codes(df['IP'])
+    n_ips = len(ip_categories)
+    observed = np.bincount(ip_codes[ip_codes >= 0], minlength=n_ips) > 0
+    pages = ~df['es_estatico'].to_numpy()
+    ip_codes, times = ip_codes[pages], epoch_seconds(df['fecha'])[pages]
+    order = group_time_order(ip_codes.astype(np.int64), times)
+    ip_codes, times = ip_codes[order], times[order]
+    del order
+
+    valid = ip_codes >= 0
+    requests = np.bincount(ip_codes[valid], minlength=n_ips)
+    first = np.full(n_ips, np.iinfo(np.int64).max)
+    last = np.full(n_ips, np.iinfo(np.int64).min)
+    np.minimum.at(first, ip_codes[valid], times[valid])
+    np.maximum.at(last, ip_codes[valid], times[valid])
+    active_seconds = np.where(requests > 0, last - first, 0)
+
+    # Intervalos entre requests consecutivas de la misma IP
+    same_ip = (ip_codes[1:] == ip_codes[:-1]) & valid[1:]
+    gaps = np.diff(times)[same_ip].astype(np.float64)
+    gap_ips = ip_codes[1:][same_ip]
+    gap_count = np.bincount(gap_ips, minlength=n_ips)
+    gap_sum = np.bincount(gap_ips, weights=gaps, minlength=n_ips)
+    gap_sq_sum = np.bincount(gap_ips, weights=gaps ** 2, minlength=n_ips)
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        mean_gap = gap_sum / gap_count
+        std_gap = np.sqrt(np.maximum(gap_sq_sum / gap_count - mean_gap ** 2, 0))
+        # Sin intervalos positivos (todo en el mismo segundo) la regularidad no está definida
+        cv_gap = np.where(mean_gap > 0, std_gap / mean_gap, np.nan)
+    # El tramo activo se cuenta como mínimo un minuto, para no inflar la tasa de IPs con pocas requests
+    active_minutes = np.maximum(active_seconds / 60, 1)
+
+    return pd.DataFrame({
+        'page_requests': requests[observed],
+        'active_seconds': active_seconds[observed],
+        'requests_per_minute': requests[observed] / active_minutes[observed],
+        'mean_interarrival_s': mean_gap[observed],
+        'interarrival_cv': cv_gap[observed]
+    }, index=pd.CategoricalIndex(ip_categories[observed], categories=ip_categories, name='IP'))
+
+@st.cache_data(max_entries=8, show_spinner=False)
+def detect_bots(dataset_key, _df):
+    """Marca por IP los bots por firma de user agent o por ritmo de requests automatizado.
+
+    Es un paso barato (firmas sobre los user agents únicos y estadísticas vectorizadas),
+    pensado para correr antes del IsolationForest y el KMeans y poder excluir los bots.
+    """
+    bots = ip_rate_features(_df)
+    ip_codes, ip_categories = category_codes(_df['IP'])
+    bot_rows = match_bot_user_agents(_df['user_agent'], get_bot_signatures())
+    valid = ip_codes >= 0
+    requests = np.bincount(ip_codes[valid], minlength=len(ip_categories))
+    bot_requests = np.bincount(ip_codes[valid], weights=bot_rows[valid], minlength=len(ip_categories))
+    bots['bot_ua_share'] = (bot_requests / np.maximum(requests, 1))[requests > 0]
+
+    by_user_agent = bots['bot_ua_share'] >= BOT_UA_MIN_SHARE
+    enough_requests = bots['page_requests'] >= BOT_MIN_REQUESTS
+    by_rate = enough_requests & (bots['requests_per_minute'] > BOT_MAX_REQUESTS_PER_MINUTE)
+    by_regularity = (
+        enough_requests
+        & (bots['active_seconds'] >= BOT_MIN_ACTIVE_SECONDS)
+        & (bots['interarrival_cv'] < BOT_MAX_INTERARRIVAL_CV)
+    )
+    bots['es_bot'] = by_user_agent | by_rate | by_regularity
+    bots['motivo_bot'] = np.select(
+        [by_user_agent, by_rate, by_regularity],
+        ['User agent', 'Frecuencia', 'Regularidad'],
+        default=''
+    )
+    return bots
+
+ANOMALY_SCORE_BATCH_SIZE = 50_000
+# IPs mínimas (sin bots, si se excluyen) para entrenar el IsolationForest y segmentar
+MODEL_MIN_IPS = 2
+NOT_ENOUGH_MODEL_IPS = (
+    f"Hay menos de {MODEL_MIN_IPS} IPs para los modelos (¿son casi todas bots?). "
+    "Desmarcá 'Excluir bots de los modelos' para incluirlas."
+)
+
+def score_in_batches(model, X, n_jobs=1, batch_size=ANOMALY_SCORE_BATCH_SIZE):
+    """Calcula score_samples por lotes de filas, repartiendo los lotes entre hilos"""
+    if len(X) <= batch_size:
+        return model.score_samples(X)
+    batches = Parallel(n_jobs=n_jobs, prefer='threads')(
+        delayed(model.score_samples)(X[start:start + batch_size])
+        for start in range(0, len(X), batch_size)
+    )
+    return np.concatenate(batches)
+
+@st.cache_resource(max_entries=8, show_spinner=False)
+def fit_anomaly_model(dataset_key, _features, max_train_ips, max_samples, _n_jobs=1):
+    """Entrena el IsolationForest una vez por dataset y configuración.
+
+    Con más de `max_train_ips` IPs se entrena sobre una muestra aleatoria, pero se
+    puntúan todas. Devuelve (scaler, modelo, scores, tiempos).
+    """
+    scaler = StandardScaler()
+    features_scaled = scaler.fit_transform(_features[MODEL_FEATURE_COLUMNS])
+
+    train = features_scaled
+    if len(train) > max_train_ips:
+        rng = np.random.RandomState(42)
+        train = train[rng.choice(len(train), max_train_ips, replace=False)]
+
+    start = time.perf_counter()
+    iso_forest = IsolationForest(
+        n_estimators=100,
+        max_samples=min(max_samples, len(train)),
+        random_state=42,
+        n_jobs=_n_jobs
+    )
+    iso_forest.fit(train)
+    fit_seconds = time.perf_counter() - start
+
+    start = time.perf_counter()
+    scores = score_in_batches(iso_forest, features_scaled, _n_jobs)
+    score_seconds = time.perf_counter() - start
+
+    timings = {'ajuste': fit_seconds, 'scoring': score_seconds, 'ips_entrenamiento': len(train)}
+    return scaler, iso_forest, scores, timings
+
+CLUSTER_K_RANGE = range(2, 6)
+# A partir de esta cantidad de IPs el modo automático usa MiniBatchKMeans
+MINIBATCH_KMEANS_MIN_IPS = 20_000
+
+@st.cache_resource(max_entries=8, show_spinner=False)
+def fit_segmentations(dataset_key, _features, algorithm):
+    """Segmenta las IPs para todos los k del slider con un scaler propio.
+
+    Devuelve etiquetas e inercia por k, de modo que cambiar el número de clusters
+    no requiere volver a entrenar.
+    """
+    scaler = StandardScaler()
+    cluster_scaled = scaler.fit_transform(_features[MODEL_FEATURE_COLUMNS])
+    if algorithm == "Automático":
+        algorithm = "MiniBatchKMeans" if len(cluster_scaled) >= MINIBATCH_KMEANS_MIN_IPS else "KMeans"
+
+    labels, inertia = {}, {}
+    # KMeans necesita al menos tantas IPs como clusters
+    for k in (k for k in CLUSTER_K_RANGE if k <= len(cluster_scaled)):
+        if algorithm == "MiniBatchKMeans":
+            model = MiniBatchKMeans(n_clusters=k, random_state=42, batch_size=4096, n_init=3)
+        else:
+            model = KMeans(n_clusters=k, random_state=42)
+        labels[k] = model.fit_predict(cluster_scaled)
+        inertia[k] = model.inertia_
+    return {'algoritmo': algorithm, 'scaler': scaler, 'labels': labels, 'inercia': inertia}
+
+# Límites para los scatter plots por IP: por encima se muestrea y se usa WebGL
+SCATTER_MAX_POINTS = 20_000
+SCATTER_WEBGL_MIN_POINTS = 5_000
+SCATTER_GRID_SIZE = 50
+
+def downsample_for_scatter(data, keep_mask=None, strata=None, max_points=SCATTER_MAX_POINTS):
+    """Reduce los puntos de un scatter por IP conservando siempre las filas de keep_mask.
+
+    El resto se muestrea por celdas de una grilla 2D (en escala log) de requests vs
+    páginas únicas, y opcionalmente por `strata`: cada celda aporta puntos en proporción
+    a su tamaño y al menos uno, así no se pierden las zonas poco densas.
+    """
+    if len(data) <= max_points:
+        return data
+    if keep_mask is None:
+        keep_mask = pd.Series(False, index=data.index)
+    kept = data[keep_mask]
+    rest = data[~keep_mask].sample(frac=1, random_state=42)
+    budget = max_points - len(kept)
+    if budget <= 0 or rest.empty:
+        return kept
+
+    cell_keys = []
+    for column in ['total_requests', 'unique_pages']:
+        values = np.log1p(rest[column].to_numpy(dtype=float))
+        scale = values.max() or 1.0
+        cell_keys.append(np.floor(values / scale * (SCATTER_GRID_SIZE - 1)).astype(np.int32))
+    if strata is not None:
+        cell_keys.append(rest[strata].to_numpy())
+    groups = rest.groupby(cell_keys, sort=False)
+    quota = np.maximum(1, np.ceil(groups['total_requests'].transform('size') * budget / len(rest)))
+    return pd.concat([kept, rest[groups.cumcount() < quota]])
+
+def scatter_render_mode(n_points):
+    return 'webgl' if n_points > SCATTER_WEBGL_MIN_POINTS else 'auto'
+
+def scatter_caption(fig, n_shown, n_total):
+    """Texto con los puntos graficados, el modo de render y el tamaño enviado al navegador"""
+    payload_kb = len(fig.to_json()) / 1024
+    mode = 'WebGL' if any(trace.type == 'scattergl' for trace in fig.data) else 'SVG'
+    sampled = f" (muestra de {n_total:,}; todas las anomalías incluidas)" if n_shown < n_total else ""
+    return f"📍 {n_shown:,} IPs graficadas{sampled} · {mode} · ~{payload_kb:,.0f} KB"
+
+def flag_anomalies(scores, contamination):
+    """Marca como anomalía la fracción `contamination` de IPs con menor score.
+
+    Equivale a entrenar con IsolationForest(contamination=...), que usa el mismo percentil
+    de score_samples como umbral, pero sin volver a ajustar los árboles.
+    """
+    threshold = np.percentile(scores, 100 * contamination)
+    return (scores < threshold).astype(int)
+
+# Formatos de exportación del dataset completo: nombre -> (extensión, tipo MIME)
+EXPORT_FORMATS = {
+    'CSV': ('csv', 'text/csv'),
+    'CSV comprimido (gzip)': ('csv.gz', 'application/gzip'),
+    'Parquet': ('parquet', 'application/vnd.apache.parquet')
+}
+EXPORT_CHUNK_ROWS = 200_000
+EXPORT_SPOOL_MAX_BYTES = 64 * 1024 ** 2
+
+def export_schema(schema):
+    """Schema Arrow del export con índices int32 en las categóricas.
+
+    Al podar categorías por bloque el tipo de los códigos varía (int8, int16...);
+    con un ancho fijo todos los bloques comparten el mismo schema.
+    """
+    return pa.schema(
+        [
+            field.with_type(pa.dictionary(pa.int32(), field.type.value_type, field.type.ordered))
+            if pa.types.is_dictionary(field.type) else field
+            for field in schema
+        ],
+        metadata=schema.metadata
+    )
+
+def export_dataset(df, export_format):
+    """Escribe el dataset por bloques en un archivo temporal y lo devuelve posicionado al inicio.
+
+    El archivo queda en memoria hasta EXPORT_SPOOL_MAX_BYTES y luego pasa a disco.
+    """
+    buffer = tempfile.SpooledTemporaryFile(max_size=EXPORT_SPOOL_MAX_BYTES)
+    chunk_starts = range(0, max(len(df), 1), EXPORT_CHUNK_ROWS)
+
+    if export_format == 'Parquet':
+        writer = None
+        for start in chunk_starts:
+            # Cada row group guarda el diccionario de sus categóricas: se dejan sólo las
+            # categorías presentes en el bloque, no las del dataset completo
+            chunk = df.iloc[start:start + EXPORT_CHUNK_ROWS].apply(
+                lambda column: column.cat.remove_unused_categories()
+                if isinstance(column.dtype, pd.CategoricalDtype) else column
+            )
+            table = pa.Table.from_pandas(chunk, preserve_index=False)
+            if writer is None:
+                writer = pq.ParquetWriter(buffer, export_schema(table.schema))
+            writer.write_table(table.cast(writer.schema))
+        writer.close()
+    else:
+        raw = gzip.GzipFile(fileobj=buffer, mode='wb') if export_format.startswith('CSV comprimido') else buffer
+        text = io.TextIOWrapper(raw, encoding='utf-8', newline='')
+        for start in chunk_starts:
+            df.iloc[start:start + EXPORT_CHUNK_ROWS].to_csv(text, header=(start == 0), index=False)
+        text.flush()
+        text.detach()
+        if raw is not buffer:
+            raw.close()
+
+    buffer.seek(0)
+    return buffer
+
+LIVE_POLL_SECONDS = 5
+LIVE_TOP_IPS = 20
+
+class LiveLogMonitor:
+    """Estado incremental del modo en vivo para un archivo de log.
+
+    Cada actualización parsea sólo las líneas nuevas y las suma a los acumuladores
+    (totales, tráfico por hora y features por IP), sin reprocesar el historial.
+    """
+
+    def __init__(self, path, from_start=False):
+        self.path = path
+        self.from_start = from_start
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            if getattr(self, 'tailer', None) is not None:
+                self.tailer.close()
+            self.tailer = LogTailer(self.path, from_start=self.from_start)
+            self.total_requests = 0
+            self.mobile_requests = 0
+            self.hourly = np.zeros(24, dtype=np.int64)
+            self.store = IPFeatureStore()
+            self._scorers = {}
+            self.last_update = None
+            self.last_batch_rows = 0
+            self.last_batch_seconds = 0.0
+
+    def update(self):
+        """Lee y acumula las líneas agregadas desde la última actualización"""
+        with self._lock:
+            start = time.perf_counter()
+            text = self.tailer.read_new()
+            batch = parse_log_text(text) if text else None
+            if batch is not None and not batch.empty:
+                batch = preprocess_data(batch, "Logs (CSV/TXT/LOG)", "Log Apache/NGINX", report_invalid=False)
+            rows = 0 if batch is None else len(batch)
+            if rows:
+                self._accumulate(batch)
+            self.last_update = datetime.now()
+            self.last_batch_rows = rows
+            self.last_batch_seconds = time.perf_counter() - start
+
+    def _accumulate(self, batch):
+        self.total_requests += len(batch)
+        self.mobile_requests += int((batch['dispositivo'] == 'Móvil').sum())
+        self.hourly += np.bincount(batch['hora'], minlength=24)
+        self.store.update(batch)
+
+    def ip_features(self, window, contamination, max_train_ips, max_samples):
+        """Features por IP de la ventana (columnas de compute_ip_features) con la marca de anomalía"""
+        with self._lock:
+            scorer = self._scorers.setdefault(window, LiveAnomalyScorer())
+            return scorer.update(self.store, window, contamination, max_train_ips, max_samples)
+
+# Se reentrena el modelo en vivo cuando la cantidad de IPs de la ventana varía más que esto
+LIVE_REFIT_CHANGE = 0.25
+
+class LiveAnomalyScorer:
+    """IsolationForest sobre una ventana del feature store que sólo vuelve a puntuar las IPs que cambiaron"""
+
+    def __init__(self):
+        self.scaler = None
+        self.model = None
+        self.fitted_ips = 0
+        self.scores = np.zeros(0)
+
+    def update(self, store, window, contamination, max_train_ips, max_samples):
+        ids, features = store.window_features(window)
+        changed = store.pop_changed(window)
+        if len(self.scores) < len(store):
+            self.scores = np.concatenate([self.scores, np.zeros(len(store) - len(self.scores))])
+        if len(features) < 2:
+            features['es_anomalia'] = 0
+            return features
+
+        values = features[FEATURE_COLUMNS].to_numpy(dtype=np.float64)
+        if self.model is None or abs(len(ids) - self.fitted_ips) > LIVE_REFIT_CHANGE * self.fitted_ips:
+            self.scaler = StandardScaler().fit(values)
+            train = self.scaler.transform(values)
+            if len(train) > max_train_ips:
+                train = train[np.random.RandomState(42).choice(len(train), max_train_ips, replace=False)]
+            self.model = IsolationForest(
+                n_estimators=100, max_samples=min(max_samples, len(train)), random_state=42
+            ).fit(train)
+            self.fitted_ips = len(ids)
+            self.scores[ids] = score_in_batches(self.model, self.scaler.transform(values))
+        else:
+            # Sólo se puntúan las IPs cuyas features cambiaron desde la actualización anterior
+            rescore = np.isin(ids, changed)
+            if rescore.any():
+                self.scores[ids[rescore]] = self.model.score_samples(self.scaler.transform(values[rescore]))
+        features['es_anomalia'] = flag_anomalies(self.scores[ids], contamination)
+        return features
+
+@st.cache_resource(show_spinner=False)
+def get_live_monitor(path, from_start):
+    """Monitor en vivo compartido entre sesiones que siguen el mismo archivo"""
+    return LiveLogMonitor(path, from_start)
+
+def render_live_panel(monitor, window, contamination, max_train_ips, max_samples):
+    """Métricas, tráfico por hora y top de IPs del modo en vivo (se refresca con un timer)"""
+    monitor.update()
+    if monitor.tailer.error is not None:
+        st.error(f"❌ No se puede leer `{monitor.path}`: {monitor.tailer.error.strerror}")
+    elif not monitor.tailer.is_open:
+        st.warning(f"No se encontró el archivo `{monitor.path}`; se reintenta en la próxima actualización")
+
+    features = monitor.ip_features(window, contamination, max_train_ips, max_samples)
+    col1, col2, col3, col4 = st.columns(4)
+    col1.metric(f"👥 Usuarios únicos ({window.lower()})", f"{len(features):,}")
+    col2.metric("📨 Total requests", f"{monitor.total_requests:,}", delta=f"+{monitor.last_batch_rows:,}")
+    col3.metric(
+        "📱 Tráfico móvil",
+        f"{monitor.mobile_requests / monitor.total_requests * 100:.1f}%" if monitor.total_requests else "0.0%"
+    )
+    col4.metric("🚨 IPs sospechosas", f"{int(features['es_anomalia'].sum()):,}")
+    st.caption(
+        f"Última actualización {monitor.last_update.strftime('%H:%M:%S')}: "
+        f"{monitor.last_batch_rows:,} líneas nuevas procesadas en {monitor.last_batch_seconds * 1000:.0f} ms"
+    )
+
+    col_hora, col_ips = st.columns(2)
+    with col_hora:
+        st.markdown("#### 📊 Tráfico por Hora del Día")
+        fig_hora = px.area(
+            pd.DataFrame({'hora': range(24), 'count': monitor.hourly}),
+            x='hora',
+            y='count',
+            labels={'hora': 'Hora del Día', 'count': 'Número de Requests'},
+            color_discrete_sequence=['#667eea']
+        )
+        fig_hora.update_layout(
+            hovermode='x unified',
+            showlegend=False,
+            height=400,
+            xaxis=dict(tickmode='linear', dtick=1),
+            plot_bgcolor='rgba(0,0,0,0)',
+            paper_bgcolor='rgba(0,0,0,0)',
+        )
+        fig_hora.update_traces(
+            hovertemplate="<b>Hora %{x}:00</b><br>%{y:,} requests<extra></extra>",
+            fill='tozeroy'
+        )
+        st.plotly_chart(fig_hora, use_container_width=True)
+    with col_ips:
+        st.markdown("#### 🔝 IPs más activas")
+        st.dataframe(features.nlargest(LIVE_TOP_IPS, 'total_requests'), use_container_width=True)
+
 # ==========================================================
 # CONFIGURACIÓN INICIAL
 # ==========================================================
@@ -263,11 +1538,63 @@ with st.sidebar:
     
     n_clusters = st.slider(
         "Número de clusters", 
-        min_value=2, 
-        max_value=5, 
+        min_value=CLUSTER_K_RANGE[0], 
+        max_value=CLUSTER_K_RANGE[-1], 
         value=3,
         help="Número de grupos para segmentación de usuarios"
     )
+
+    segmentation_algorithm = st.selectbox(
+        "Algoritmo de segmentación",
+        ["Automático", "KMeans", "MiniBatchKMeans"],
+        help="Automático usa MiniBatchKMeans cuando hay muchas IPs"
+    )
+    exclude_bots = st.checkbox(
+        "Excluir bots de los modelos",
+        value=True,
+        help="Las IPs marcadas como bot (firma de user agent o ritmo automatizado) no participan "
+             "del IsolationForest ni de la segmentación"
+    )
+
+    st.markdown("### 🚀 Rendimiento")
+    max_workers = os.cpu_count() or 1
+    parse_workers = st.number_input(
+        "Procesos para parsear logs",
+        min_value=1,
+        max_value=max_workers,
+        value=max_workers,
+        help="Cantidad de procesos usados para parsear en paralelo logs Apache/NGINX grandes o varios archivos a la vez"
+    )
+    ml_jobs = st.number_input(
+        "Núcleos para entrenar modelos",
+        min_value=1,
+        max_value=max_workers,
+        value=max_workers,
+        help="Núcleos usados por el IsolationForest para entrenar y puntuar"
+    )
+    max_train_ips = st.number_input(
+        "Máx. IPs para entrenar",
+        min_value=1_000,
+        max_value=10_000_000,
+        value=200_000,
+        step=10_000,
+        help="Con más IPs, el modelo se entrena con una muestra aleatoria y luego puntúa a todas"
+    )
+    tree_samples = st.number_input(
+        "Muestras por árbol (max_samples)",
+        min_value=16,
+        max_value=65_536,
+        value=256,
+        step=16,
+        help="Tamaño de la submuestra con la que se construye cada árbol del IsolationForest"
+    )
+    sketch_mode = st.checkbox(
+        "Modo aproximado (sketches)",
+        value=False,
+        help="Lee los archivos por bloques guardando sólo sketches de memoria constante (HyperLogLog "
+             "para usuarios y URLs distintas, Count-Min para los rankings) y muestra un resumen reducido "
+             "con cotas de error, sin features por IP ni modelos. Para datasets que no entran en memoria"
+    )
     
     st.markdown("---")
     st.markdown("#### 📊 Información")
@@ -289,28 +1616,99 @@ st.markdown("### 📁 Carga de Datos")
 # Selector de tipo de archivo
 file_type = st.radio(
     "Selecciona el tipo de archivo:",
-    ["JSON", "Logs (CSV/TXT/LOG)"],
+    ["JSON", "Logs (CSV/TXT/LOG)", "Parquet/Arrow", "En vivo (tail)"],
     horizontal=True,
     help="Elige el formato de tu archivo de datos"
 )
 
 uploaded_file = None
+uploaded_files, local_paths = [], []
 log_format = None
+date_range = None
 
 if file_type == "JSON":
-    uploaded_file = st.file_uploader(
+    uploaded_files, local_paths = select_sources(
         "Subí tu archivo `datos.json` para comenzar el análisis", 
-        type=["json"], 
-        help="Archivo JSON con los logs de acceso web en el formato especificado"
+        ["json", "ndjson", "jsonl"] + COMPRESSED_UPLOAD_TYPES, 
+        "Archivos JSON con los logs de acceso web en el formato especificado (pueden venir comprimidos en .gz, .bz2 o .zst)",
+        "*.json*"
     )
-else:  # Logs (CSV/TXT/LOG)
+
+    if uploaded_files or local_paths:
+        first_name = uploaded_files[0].name if uploaded_files else local_paths[0]
+        json_formats = ["Arreglo JSON", NDJSON_FORMAT]
+        log_format = st.selectbox(
+            "Estructura del JSON:",
+            json_formats,
+            index=1 if base_upload_name(first_name).lower().endswith(('.ndjson', '.jsonl')) else 0,
+            help="NDJSON se lee por bloques, sin cargar el archivo completo en memoria"
+        )
+elif file_type == "Parquet/Arrow":
     uploaded_file = st.file_uploader(
-        "Subí tu archivo de logs", 
-        type=["csv", "txt", "log"], 
-        help="Archivo de logs en formato CSV, TXT o LOG"
+        "Subí tu archivo Parquet, Feather o Arrow IPC",
+        type=["parquet", "feather", "arrow"],
+        help="Sólo se leen las columnas que usa el dashboard"
+    )
+
+    if uploaded_file and st.checkbox("Filtrar por rango de fechas"):
+        selected_dates = st.date_input(
+            "Rango de fechas",
+            value=(datetime.now().date() - pd.Timedelta(days=7), datetime.now().date()),
+            help="En Parquet se descartan los row groups que quedan fuera del rango sin leerlos"
+        )
+        if len(selected_dates) == 2:
+            date_range = (pd.Timestamp(selected_dates[0]), pd.Timestamp(selected_dates[1]) + pd.Timedelta(days=1))
+elif file_type == "En vivo (tail)":
+    if not LOG_ROOT:
+        st.info(LOG_ROOT_DISABLED)
+        st.stop()
+    live_path = st.text_input(
+        "Archivo de log a seguir",
+        help=f"Ruta de un access log Apache/NGINX dentro de {LOG_ROOT}, p. ej. access.log (se siguen sus rotaciones)"
+    )
+    col_live1, col_live2 = st.columns(2)
+    with col_live1:
+        live_from_start = st.checkbox(
+            "Incluir el contenido actual del archivo",
+            value=False,
+            help="Si no se marca, sólo se analizan las líneas que se agreguen desde ahora"
+        )
+    with col_live2:
+        live_interval = st.number_input(
+            "Intervalo de actualización (segundos)", min_value=1, max_value=60, value=LIVE_POLL_SECONDS
+        )
+    live_window = st.selectbox(
+        "Ventana de análisis por IP",
+        list(WINDOWS),
+        index=1,
+        help="Las features por IP y la detección de anomalías usan sólo la actividad de esta ventana"
+    )
+
+    if live_path and resolve_log_path(live_path) is None:
+        st.error(f"❌ Sólo se pueden seguir archivos dentro de {LOG_ROOT}")
+    elif live_path and os.path.exists(resolve_log_path(live_path)) and not os.path.isfile(resolve_log_path(live_path)):
+        st.error(f"❌ `{live_path}` no es un archivo: indicá la ruta de un access log")
+    elif live_path:
+        monitor = get_live_monitor(resolve_log_path(live_path), live_from_start)
+        if st.button("🔄 Reiniciar métricas"):
+            monitor.reset()
+        # Sólo el panel se vuelve a ejecutar con el timer, no todo el script
+        st.fragment(render_live_panel, run_every=live_interval)(
+            monitor, live_window, contamination_rate, max_train_ips, tree_samples
+        )
+    else:
+        st.info("Indicá la ruta de un access log para seguirlo en vivo")
+    # El modo en vivo reemplaza al análisis del archivo completo
+    st.stop()
+else:  # Logs (CSV/TXT/LOG)
+    uploaded_files, local_paths = select_sources(
+        "Subí tus archivos de logs", 
+        ["csv", "txt", "log"] + COMPRESSED_UPLOAD_TYPES, 
+        "Archivos de logs en formato CSV, TXT o LOG (pueden venir comprimidos en .gz, .bz2 o .zst, como los logs rotados)",
+        "access.log*"
     )
     
-    if uploaded_file:
+    if uploaded_files or local_paths:
         st.info("""
         **Formatos soportados:**
         - CSV con columnas: fecha, IP, url, user_agent
@@ -325,74 +1723,180 @@ else:  # Logs (CSV/TXT/LOG)
             help="Selecciona el formato de tu archivo de log"
         )
 
-if uploaded_file:
-    try:
-        with st.spinner('📥 Cargando y procesando archivo...'):
-            if file_type == "JSON":
-                df = pd.read_json(uploaded_file)
-                
-            else:  # Logs (CSV/TXT/LOG)
-                if log_format == "CSV con columnas":
-                    # Leer como CSV
-                    df = pd.read_csv(uploaded_file)
-                    # Verificar columnas mínimas requeridas
-                    required_columns = ['fecha', 'IP', 'url', 'user_agent']
-                    missing_columns = [col for col in required_columns if col not in df.columns]
+# Un solo archivo subido sigue el camino de lectura por bloques; varios archivos
+# (o una carpeta local) se leen en paralelo, un archivo por proceso
+multi_source = len(uploaded_files) > 1 or bool(local_paths)
+if len(uploaded_files) == 1 and not local_paths:
+    uploaded_file = uploaded_files[0]
+
+if uploaded_file or multi_source:
+    # Los sliders del sidebar vuelven a ejecutar todo el script: si el archivo no cambió,
+    # se reutiliza el dataset ya preprocesado en lugar de volver a leerlo y parsearlo
+    # La versión del preprocesamiento y de la tabla de rangos IP también forman parte de la
+    # clave, para no servir datasets de la caché en disco procesados con reglas viejas
+    read_options = (file_type, log_format, date_range, CACHE_VERSION, ip_ranges_version())
+    if multi_source:
+        source_name = f"{len(uploaded_files) + len(local_paths)} archivos"
+        cache_key = compute_sources_key(uploaded_files, local_paths, *read_options)
+    else:
+        source_name = uploaded_file.name
+        cache_key = compute_upload_key(uploaded_file.getbuffer(), *read_options)
+
+    if sketch_mode:
+        if file_type == "Parquet/Arrow" or source_reader(file_type, log_format) in STREAMABLE_READERS:
+            uploads = [uploaded_file] if not multi_source else uploaded_files
+            try:
+                with st.spinner('📥 Leyendo por bloques y armando los sketches...'):
+                    summary = build_sketch_summary(
+                        cache_key,
+                        iter_sketch_chunks(uploads, local_paths, file_type, log_format, date_range),
+                        file_type, log_format, date_range
+                    )
+            except Exception as e:
+                st.error(f"❌ Error al cargar el archivo: {str(e)}")
+                st.stop()
+            render_sketch_summary(summary, source_name)
+            # El resumen aproximado reemplaza al análisis completo
+            st.stop()
+        st.info("Un arreglo JSON no se puede leer por bloques: se hace el análisis completo, sin sketches")
+    processed_cache = get_processed_cache()
+    disk_cache = get_disk_cache()
+    cached_entry = processed_cache.get(cache_key)
+    cache_source = 'memoria'
+
+    if cached_entry is None:
+        # Segundo nivel: datasets procesados en sesiones o días anteriores
+        cached_entry = disk_cache.get(cache_key)
+        cache_source = 'disco'
+        if cached_entry is not None:
+            processed_cache.put(cache_key, cached_entry)
+
+    if cached_entry is None:
+        df_processed = None
+        try:
+            with st.spinner('📥 Cargando y procesando archivo...'):
+                if multi_source:
+                    df = load_multiple_sources(
+                        uploaded_files, local_paths, source_reader(file_type, log_format), parse_workers
+                    )
+                    if df.empty:
+                        st.error("❌ No se pudieron leer registros de los archivos seleccionados. Verifica el formato.")
+                        st.stop()
+                    missing_columns = [col for col in REQUIRED_COLUMNS if col not in df.columns]
                     if missing_columns:
                         st.error(f"❌ Faltan columnas requeridas: {missing_columns}")
                         st.stop()
-                        
-                elif log_format == "Log Apache/NGINX":
-                    # Leer y parsear logs
-                    content = uploaded_file.getvalue().decode('utf-8')
-                    lines = content.split('\n')
-                    
-                    parsed_data = []
-                    for line in lines:
-                        if line.strip():  # Saltar líneas vacías
-                            parsed = parse_log_line(line)
-                            if parsed:
-                                parsed_data.append(parsed)
+
+                elif file_type == "JSON":
+                    if log_format == NDJSON_FORMAT:
+                        df_processed, raw_info = load_ndjson(open_upload(uploaded_file))
+                    else:
+                        df = pd.read_json(open_upload(uploaded_file))
                     
-                    if not parsed_data:
-                        st.error("❌ No se pudieron parsear los logs. Verifica el formato.")
+                elif file_type == "Parquet/Arrow":
+                    df = read_columnar_upload(uploaded_file, date_range)
+                    missing_columns = [col for col in REQUIRED_COLUMNS if col not in df.columns]
+                    if missing_columns:
+                        st.error(f"❌ Faltan columnas requeridas: {missing_columns}")
                         st.stop()
-                        
-                    df = pd.DataFrame(parsed_data)
-                    
-                else:  # Personalizado
-                    # Intentar detectar automáticamente el formato
-                    content = uploaded_file.getvalue().decode('utf-8')
-                    lines = content.split('\n')[:10]  # Primeras 10 líneas para análisis
-                    
-                    # Mostrar vista previa
-                    st.markdown("**Vista previa de las primeras líneas:**")
-                    for i, line in enumerate(lines[:5]):
-                        st.text(f"Línea {i+1}: {line[:100]}...")
                     
-                    st.info("Para formato personalizado, asegúrate de que el archivo tenga las columnas: fecha, IP, url, user_agent")
-                    df = pd.read_csv(uploaded_file)
+                else:  # Logs (CSV/TXT/LOG)
+                    if log_format == "CSV con columnas":
+                        # Leer como CSV
+                        df = pd.read_csv(open_upload(uploaded_file))
+                        # Verificar columnas mínimas requeridas
+                        missing_columns = [col for col in REQUIRED_COLUMNS if col not in df.columns]
+                        if missing_columns:
+                            st.error(f"❌ Faltan columnas requeridas: {missing_columns}")
+                            st.stop()
+                            
+                    elif log_format == "Log Apache/NGINX":
+                        # Leer y parsear logs por bloques, sin decodificar el archivo completo
+                        stream = open_upload(uploaded_file)
+                        # En una subida comprimida el tamaño real recién se conoce al descomprimirla
+                        compressed = file_compression(uploaded_file.name) is not None
+                        if parse_workers > 1 and (compressed or uploaded_file.size >= PARALLEL_PARSE_MIN_BYTES):
+                            # Volcar la subida (ya descomprimida) a un archivo temporal
+                            # para que cada proceso lea su fragmento
+                            with tempfile.NamedTemporaryFile(suffix='.log', delete=False) as tmp:
+                                shutil.copyfileobj(stream, tmp)
+                            try:
+                                if os.path.getsize(tmp.name) >= PARALLEL_PARSE_MIN_BYTES:
+                                    df = parse_log_file_parallel(tmp.name, parse_workers)
+                                else:
+                                    with open(tmp.name, 'rb') as f:
+                                        df = parse_log_stream(f)
+                            finally:
+                                os.remove(tmp.name)
+                        else:
+                            df = parse_log_stream(stream)
+                        
+                        if df.empty:
+                            st.error("❌ No se pudieron parsear los logs. Verifica el formato.")
+                            st.stop()
+                        
+                    else:  # Personalizado
+                        # Intentar detectar automáticamente el formato
+                        # Sólo se leen las primeras 10 líneas para el análisis
+                        stream = open_upload(uploaded_file)
+                        lines = [stream.readline().decode('utf-8', errors='replace').rstrip('\n') for _ in range(10)]
+                        
+                        # Mostrar vista previa
+                        st.markdown("**Vista previa de las primeras líneas:**")
+                        for i, line in enumerate(lines[:5]):
+                            st.text(f"Línea {i+1}: {line[:100]}...")
+                        
+                        st.info("Para formato personalizado, asegúrate de que el archivo tenga las columnas: fecha, IP, url, user_agent")
+                        df = pd.read_csv(open_upload(uploaded_file))
 
-        # Mostrar información del dataset cargado
-        st.success(f"✅ **{len(df):,} registros** cargados correctamente desde {uploaded_file.name}")
-        
-        # Mostrar vista previa de los datos
-        with st.expander("👁️ Vista previa de los datos crudos"):
-            st.dataframe(df.head(), use_container_width=True)
-            st.markdown(f"**Forma del dataset:** {df.shape[0]} filas × {df.shape[1]} columnas")
-            
-            if 'fecha' in df.columns:
-                st.markdown(f"**Rango de fechas:** {df['fecha'].min()} a {df['fecha'].max()}")
+        except Exception as e:
+            st.error(f"❌ Error al cargar el archivo: {str(e)}")
+            st.stop()
 
-    except Exception as e:
-        st.error(f"❌ Error al cargar el archivo: {str(e)}")
-        st.stop()
+        # ==========================================================
+        # PREPROCESAMIENTO
+        # ==========================================================
+        # Los lectores por bloques (NDJSON) ya devuelven los datos preprocesados
+        if df_processed is None:
+            with st.spinner('🔄 Procesando datos y generando visualizaciones...'):
+                df_processed = preprocess_data(df.copy(), file_type, log_format)
+                if date_range is not None:
+                    # Filtrado exacto por fila (los row groups sólo descartan bloques completos)
+                    df_processed = df_processed[
+                        (df_processed['fecha'] >= date_range[0]) & (df_processed['fecha'] < date_range[1])
+                    ]
+            raw_info = describe_raw(df)
+            del df
 
-    # ==========================================================
-    # PREPROCESAMIENTO
-    # ==========================================================
-    with st.spinner('🔄 Procesando datos y generando visualizaciones...'):
-        df_processed = preprocess_data(df.copy(), file_type, log_format)
+        cached_entry = {'df_processed': df_processed, **raw_info}
+        if df_processed is not None and len(df_processed) > 0:
+            processed_cache.put(cache_key, cached_entry)
+            try:
+                disk_cache.put(cache_key, cached_entry)
+            except Exception as e:
+                st.warning(f"No se pudo guardar el dataset en la caché en disco: {str(e)}")
+    elif cache_source == 'disco':
+        st.info("💽 Archivo ya procesado anteriormente: se cargan los datos desde la caché en disco")
+    else:
+        st.info("⚡ Archivo sin cambios: se reutilizan los datos ya procesados")
+
+    df_processed = cached_entry['df_processed']
+    raw_rows, raw_cols = cached_entry['raw_shape']
+
+    # Mostrar información del dataset cargado
+    st.success(f"✅ **{raw_rows:,} registros** cargados correctamente desde {source_name}")
+    
+    # Mostrar vista previa de los datos
+    with st.expander("👁️ Vista previa de los datos crudos"):
+        st.dataframe(cached_entry['raw_preview'], use_container_width=True)
+        st.markdown(f"**Forma del dataset:** {raw_rows} filas × {raw_cols} columnas")
+        raw_memory = cached_entry['raw_memory']
+        st.markdown(f"**Memoria en uso:** {raw_memory['memoria_MB'].sum():,.1f} MB")
+        st.dataframe(raw_memory.round(2), use_container_width=True)
+        
+        if cached_entry['raw_date_range'] is not None:
+            fecha_min, fecha_max = cached_entry['raw_date_range']
+            st.markdown(f"**Rango de fechas:** {fecha_min} a {fecha_max}")
 
     # Verificar que tenemos datos después del preprocesamiento
     if df_processed is None or len(df_processed) == 0:
@@ -408,35 +1912,42 @@ if uploaded_file:
 
     # Cálculo de métricas con manejo de errores
     try:
-        features = df_processed.groupby('IP').agg({
-            'fecha': 'count',
-            'url': 'nunique',
-            'hora': 'nunique'
-        }).rename(columns={'fecha': 'total_requests', 'url': 'unique_pages', 'hora': 'unique_hours'})
-
-        scaler = StandardScaler()
-        features_scaled = scaler.fit_transform(features)
-        iso_forest = IsolationForest(contamination=contamination_rate, random_state=42, n_estimators=100)
-        anomalies = iso_forest.fit_predict(features_scaled)
-        features['es_anomalia'] = np.where(anomalies == -1, 1, 0)
+        # Un único recorrido del dataset alimenta todas las métricas y gráficos de conteo
+        aggregates = build_aggregates(cache_key, df_processed)
+        cube = aggregates['cube']
+
+        # Features y modelo se cachean por dataset: mover el slider de sensibilidad
+        # sólo vuelve a calcular el umbral sobre los scores ya obtenidos
+        features = compute_ip_features(cache_key, df_processed).join(detect_bots(cache_key, df_processed))
+        features['es_anomalia'] = 0
+        # Los bots se marcan antes de los modelos para poder dejarlos fuera del entrenamiento
+        model_key = f"{cache_key}:sin_bots" if exclude_bots else cache_key
+        model_mask = ~features['es_bot'] if exclude_bots else pd.Series(True, index=features.index)
+        model_features = features[model_mask]
+        if len(model_features) >= MODEL_MIN_IPS:
+            scaler, iso_forest, anomaly_scores, anomaly_timings = fit_anomaly_model(
+                model_key, model_features, max_train_ips, tree_samples, _n_jobs=ml_jobs
+            )
+            features.loc[model_mask, 'es_anomalia'] = flag_anomalies(anomaly_scores, contamination_rate)
+            model_features = features[model_mask]
 
         # Calcular métricas con valores por defecto
-        usuarios_unicos = df_processed['IP'].nunique()
+        usuarios_unicos = len(features)
         total_requests = len(df_processed)
         
         # Manejar el caso donde no hay datos de dispositivo
         try:
-            porcentaje_movil = (df_processed['dispositivo'] == 'Móvil').mean() * 100
+            porcentaje_movil = cube_totals(cube, 'dispositivo').get('Móvil', 0) / total_requests * 100
         except:
             porcentaje_movil = 0
         
         try:
-            navegador_principal = df_processed['navegador'].mode()[0] if len(df_processed['navegador'].mode()) > 0 else 'N/A'
+            navegador_principal = cube_top_label(cube, 'navegador')
         except:
             navegador_principal = 'N/A'
             
         try:
-            pais_predominante = df_processed['pais'].mode()[0] if len(df_processed['pais'].mode()) > 0 else 'N/A'
+            pais_predominante = cube_top_label(cube, 'pais')
         except:
             pais_predominante = 'N/A'
             
@@ -457,7 +1968,8 @@ if uploaded_file:
             'Navegador principal': navegador_principal,
             'País predominante': pais_predominante,
             '% Anomalías': porcentaje_anomalias,
-            'IPs sospechosas': ips_sospechosas
+            'IPs sospechosas': ips_sospechosas,
+            'IPs bot': int(features['es_bot'].sum())
         }
 
     except Exception as e:
@@ -470,7 +1982,8 @@ if uploaded_file:
             'Navegador principal': 'N/A',
             'País predominante': 'N/A',
             '% Anomalías': 0,
-            'IPs sospechosas': 0
+            'IPs sospechosas': 0,
+            'IPs bot': 0
         }
 
     # Mostrar métricas en columnas
@@ -513,6 +2026,33 @@ if uploaded_file:
         </div>
         """, unsafe_allow_html=True)
 
+    try:
+        bot_ips = features[features['es_bot']]
+        st.caption(
+            f"🤖 {len(bot_ips):,} IPs marcadas como bots "
+            f"({bot_ips['total_requests'].sum() / max(len(df_processed), 1):.1%} de las requests)"
+            + (" · excluidas de la detección de anomalías y la segmentación" if exclude_bots else "")
+        )
+        if len(bot_ips) > 0:
+            with st.expander("🤖 Ver IPs marcadas como bots"):
+                st.dataframe(
+                    bot_ips[['motivo_bot', 'total_requests', 'requests_per_minute', 'interarrival_cv', 'bot_ua_share']]
+                    .sort_values('total_requests', ascending=False),
+                    use_container_width=True
+                )
+    except Exception as e:
+        st.warning(f"No se pudo calcular la detección de bots: {str(e)}")
+
+    try:
+        _, session_summary = compute_session_stats(cache_key, df_processed)
+        st.caption(
+            f"🧭 {session_summary['sesiones']:,} sesiones (corte tras {SESSION_GAP_MINUTES} min de inactividad) · "
+            f"duración media {session_summary['duracion_media_s'] / 60:.1f} min · "
+            f"{session_summary['profundidad_media']:.1f} requests y {session_summary['paginas_media']:.1f} páginas por sesión"
+        )
+    except Exception as e:
+        st.warning(f"No se pudieron calcular las sesiones: {str(e)}")
+
     # ==========================================================
     # VISUALIZACIONES INTERACTIVAS CON PLOTLY
     # ==========================================================
@@ -527,7 +2067,7 @@ if uploaded_file:
         
         # Tráfico por hora con manejo de errores
         try:
-            trafico_por_hora = df_processed.groupby('hora').size().reset_index(name='count')
+            trafico_por_hora = cube_totals(cube, 'hora').reset_index(name='count')
             
             fig_hora = px.area(
                 trafico_por_hora, 
@@ -561,7 +2101,8 @@ if uploaded_file:
         
         try:
             # Distribución por países
-            pais_distribution = df_processed['pais'].value_counts().reset_index()
+            pais_totals = cube_totals(cube, 'pais')
+            pais_distribution = pais_totals.sort_values(ascending=False).reset_index()
             pais_distribution.columns = ['pais', 'count']
             
             fig_pie = px.pie(
@@ -602,7 +2143,7 @@ if uploaded_file:
         st.markdown("#### 📱 Distribución por Dispositivo")
         
         try:
-            dispositivo_data = df_processed['dispositivo'].value_counts().reset_index()
+            dispositivo_data = cube_totals(cube, 'dispositivo').sort_values(ascending=False).reset_index()
             dispositivo_data.columns = ['dispositivo', 'count']
             
             fig_dev = px.bar(
@@ -638,7 +2179,8 @@ if uploaded_file:
         st.markdown("#### 🌐 Navegadores Más Utilizados")
         
         try:
-            navegador_data = df_processed['navegador'].value_counts().reset_index()
+            navegador_totals = cube_totals(cube, 'navegador')
+            navegador_data = navegador_totals.sort_values(ascending=False).reset_index()
             navegador_data.columns = ['navegador', 'count']
             
             fig_nav = px.pie(
@@ -675,7 +2217,7 @@ if uploaded_file:
     st.markdown("#### 🔥 Top 10 Páginas Más Visitadas")
     
     try:
-        paginas_populares = df_processed[~df_processed['es_estatico']]['url'].value_counts().head(10).reset_index()
+        paginas_populares = aggregates['top_pages'].reset_index()
         paginas_populares.columns = ['url', 'visitas']
         
         # Acortar URLs largas para mejor visualización
@@ -724,119 +2266,145 @@ if uploaded_file:
     with col5:
         st.markdown("#### 🚨 Detección de Anomalías y Bots")
         
-        try:
-             # AGREGAR ESTA REFERENCIA DE COLORES:
-            st.markdown("""
-            <div style='background: #f8f9fa; padding: 0.75rem; border-radius: 8px; border-left: 4px solid #cccc; margin-bottom: 1rem;'>
-                <div style='display: flex; gap: 1rem; font-size: 0.8rem; justify-content: center;'>
-                    <div style='display: flex; align-items: center; gap: 0.3rem;'>
-                        <div style='width: 12px; height: 12px; background: #B0DAF7; border-radius: 50%;'></div>
-                        <span>Comportamiento Normal</span>
-                    </div>
-                    <div style='display: flex; align-items: center; gap: 0.3rem;'>
-                        <div style='width: 12px; height: 12px; background: #095E99; border-radius: 50%;'></div>
-                        <span>Anomalía Detectada</span>
+        if len(model_features) < MODEL_MIN_IPS:
+            st.info(NOT_ENOUGH_MODEL_IPS)
+        else:
+            try:
+                 # AGREGAR ESTA REFERENCIA DE COLORES:
+                st.markdown("""
+                <div style='background: #f8f9fa; padding: 0.75rem; border-radius: 8px; border-left: 4px solid #cccc; margin-bottom: 1rem;'>
+                    <div style='display: flex; gap: 1rem; font-size: 0.8rem; justify-content: center;'>
+                        <div style='display: flex; align-items: center; gap: 0.3rem;'>
+                            <div style='width: 12px; height: 12px; background: #B0DAF7; border-radius: 50%;'></div>
+                            <span>Comportamiento Normal</span>
+                        </div>
+                        <div style='display: flex; align-items: center; gap: 0.3rem;'>
+                            <div style='width: 12px; height: 12px; background: #095E99; border-radius: 50%;'></div>
+                            <span>Anomalía Detectada</span>
+                        </div>
                     </div>
                 </div>
-            </div>
-            """, unsafe_allow_html=True)
-            # Preparar datos para el scatter plot
-            scatter_data = features.reset_index()
+                """, unsafe_allow_html=True)
+                # Preparar datos para el scatter plot
+                scatter_data = downsample_for_scatter(
+                    model_features, keep_mask=model_features['es_anomalia'] == 1
+                ).reset_index()
             
-            fig_anomalies = px.scatter(
-                scatter_data,
-                x='total_requests',
-                y='unique_pages',
-                color='es_anomalia',
-                color_discrete_map={0: '#2ecc71', 1: '#e74c3c'},
-                size='unique_hours',
-                hover_data=['IP'],
-                labels={
-                    'total_requests': 'Total de Requests por IP',
-                    'unique_pages': 'Páginas Únicas Visitadas',
-                    'es_anomalia': 'Es Anomalía'
-                },
-            )
+                fig_anomalies = px.scatter(
+                    scatter_data,
+                    render_mode=scatter_render_mode(len(scatter_data)),
+                    x='total_requests',
+                    y='unique_pages',
+                    color='es_anomalia',
+                    color_discrete_map={0: '#2ecc71', 1: '#e74c3c'},
+                    size='unique_hours',
+                    hover_data=['IP'],
+                    labels={
+                        'total_requests': 'Total de Requests por IP',
+                        'unique_pages': 'Páginas Únicas Visitadas',
+                        'es_anomalia': 'Es Anomalía'
+                    },
+                )
             
-            fig_anomalies.update_layout(
-                height=500,
-                plot_bgcolor='rgba(0,0,0,0)',
-                paper_bgcolor='rgba(0,0,0,0)',
-                legend=dict(
-                    orientation="h",
-                    yanchor="bottom",
-                    y=1.02,
-                    xanchor="right",
-                    x=1
+                fig_anomalies.update_layout(
+                    height=500,
+                    plot_bgcolor='rgba(0,0,0,0)',
+                    paper_bgcolor='rgba(0,0,0,0)',
+                    legend=dict(
+                        orientation="h",
+                        yanchor="bottom",
+                        y=1.02,
+                        xanchor="right",
+                        x=1
+                    )
                 )
-            )
             
-            fig_anomalies.update_traces(
-                hovertemplate="<b>IP: %{customdata[0]}</b><br>Requests: %{x}<br>Páginas únicas: %{y}<extra></extra>",
-                marker=dict(opacity=0.7, line=dict(width=1, color='DarkSlateGrey'))
-            )
+                fig_anomalies.update_traces(
+                    hovertemplate="<b>IP: %{customdata[0]}</b><br>Requests: %{x}<br>Páginas únicas: %{y}<extra></extra>",
+                    marker=dict(opacity=0.7, line=dict(width=1, color='DarkSlateGrey'))
+                )
             
-            st.plotly_chart(fig_anomalies, use_container_width=True)
-        except Exception as e:
-            st.error(f"Error generando gráfico de anomalías: {str(e)}")
-            st.info("No se pudieron generar los datos para el gráfico de detección de anomalías")
+                st.plotly_chart(fig_anomalies, use_container_width=True)
+                st.caption(scatter_caption(fig_anomalies, len(scatter_data), len(model_features)))
+                st.caption(
+                    f"⏱️ Entrenamiento: {anomaly_timings['ajuste']:.2f} s "
+                    f"({anomaly_timings['ips_entrenamiento']:,} IPs) · "
+                    f"Scoring: {anomaly_timings['scoring']:.2f} s ({len(model_features):,} IPs)"
+                )
+            except Exception as e:
+                st.error(f"Error generando gráfico de anomalías: {str(e)}")
+                st.info("No se pudieron generar los datos para el gráfico de detección de anomalías")
 
     with col6:
         st.markdown("#### 👥 Segmentación de Usuarios por Comportamiento")
         
-        try:
-            # AGREGAR ESTA REFERENCIA DE COLORES:
-            st.markdown("""
-            <div style='background: #f8f9fa; padding: 0.75rem; border-radius: 8px; border-left: 4px solid #cccc; margin-bottom: 1rem;'>
-                <div style='display: flex; gap: 1rem; font-size: 0.8rem; justify-content: center;'>
-                    <div style='display: flex; align-items: center; gap: 0.3rem;'>
-                        <div style='width: 12px; height: 12px; background: #095E99; border-radius: 50%;'></div>
-                        <span>Comportamiento Normal</span>
-                    </div>
-                    <div style='display: flex; align-items: center; gap: 0.3rem;'>
-                        <div style='width: 12px; height: 12px; background: #590D0D; border-radius: 50%;'></div>
-                        <span>Anomalía Detectada</span>
+        if len(model_features) < MODEL_MIN_IPS:
+            st.info(NOT_ENOUGH_MODEL_IPS)
+        else:
+            try:
+                # AGREGAR ESTA REFERENCIA DE COLORES:
+                st.markdown("""
+                <div style='background: #f8f9fa; padding: 0.75rem; border-radius: 8px; border-left: 4px solid #cccc; margin-bottom: 1rem;'>
+                    <div style='display: flex; gap: 1rem; font-size: 0.8rem; justify-content: center;'>
+                        <div style='display: flex; align-items: center; gap: 0.3rem;'>
+                            <div style='width: 12px; height: 12px; background: #095E99; border-radius: 50%;'></div>
+                            <span>Comportamiento Normal</span>
+                        </div>
+                        <div style='display: flex; align-items: center; gap: 0.3rem;'>
+                            <div style='width: 12px; height: 12px; background: #590D0D; border-radius: 50%;'></div>
+                            <span>Anomalía Detectada</span>
+                        </div>
                     </div>
                 </div>
-            </div>
-            """, unsafe_allow_html=True)
-            # K-Means Clustering
-            cluster_features = features[['total_requests', 'unique_pages', 'unique_hours']].dropna()
-            cluster_scaled = scaler.fit_transform(cluster_features)
-            kmeans = KMeans(n_clusters=n_clusters, random_state=42)
-            cluster_features = cluster_features.copy()
-            cluster_features['cluster'] = kmeans.fit_predict(cluster_scaled)
+                """, unsafe_allow_html=True)
+                # K-Means Clustering: todos los k se calculan una vez por dataset y el slider sólo elige
+                segmentations = fit_segmentations(model_key, model_features, segmentation_algorithm)
+                k_shown = n_clusters
+                if k_shown not in segmentations['labels']:
+                    k_shown = max(segmentations['labels'])
+                    st.info(f"Con {len(model_features):,} IPs no se pueden formar {n_clusters} grupos: se muestran {k_shown}")
+                cluster_features = model_features[MODEL_FEATURE_COLUMNS].copy()
+                cluster_features['cluster'] = segmentations['labels'][k_shown]
+                cluster_plot_data = downsample_for_scatter(
+                    cluster_features, keep_mask=model_features['es_anomalia'] == 1, strata='cluster'
+                ).reset_index()
             
-            fig_clusters = px.scatter(
-                cluster_features.reset_index(),
-                x='total_requests',
-                y='unique_pages',
-                color='cluster',
-                color_continuous_scale='RdBu_r',
-                size='unique_hours',
-                hover_data=['IP'],
-                labels={
-                    'total_requests': 'Total de Requests por IP',
-                    'unique_pages': 'Páginas Únicas Visitadas',
-                    'cluster': 'Grupo'
-                },
-            )
+                fig_clusters = px.scatter(
+                    cluster_plot_data,
+                    render_mode=scatter_render_mode(len(cluster_plot_data)),
+                    x='total_requests',
+                    y='unique_pages',
+                    color='cluster',
+                    color_continuous_scale='RdBu_r',
+                    size='unique_hours',
+                    hover_data=['IP'],
+                    labels={
+                        'total_requests': 'Total de Requests por IP',
+                        'unique_pages': 'Páginas Únicas Visitadas',
+                        'cluster': 'Grupo'
+                    },
+                )
             
-            fig_clusters.update_layout(
-                height=500,
-                plot_bgcolor='rgba(0,0,0,0)',
-                paper_bgcolor='rgba(0,0,0,0)',
-            )
+                fig_clusters.update_layout(
+                    height=500,
+                    plot_bgcolor='rgba(0,0,0,0)',
+                    paper_bgcolor='rgba(0,0,0,0)',
+                )
             
-            fig_clusters.update_traces(
-                hovertemplate="<b>IP: %{customdata[0]}</b><br>Requests: %{x}<br>Páginas únicas: %{y}<br>Grupo: %{marker.color}<extra></extra>",
-                marker=dict(opacity=0.7, line=dict(width=1, color='DarkSlateGrey'))
-            )
+                fig_clusters.update_traces(
+                    hovertemplate="<b>IP: %{customdata[0]}</b><br>Requests: %{x}<br>Páginas únicas: %{y}<br>Grupo: %{marker.color}<extra></extra>",
+                    marker=dict(opacity=0.7, line=dict(width=1, color='DarkSlateGrey'))
+                )
             
-            st.plotly_chart(fig_clusters, use_container_width=True)
-        except Exception as e:
-            st.error(f"Error generando gráfico de segmentación: {str(e)}")
-            st.info("No se pudieron generar los datos para el gráfico de segmentación de usuarios")
+                st.plotly_chart(fig_clusters, use_container_width=True)
+                st.caption(scatter_caption(fig_clusters, len(cluster_plot_data), len(cluster_features)))
+                st.caption(
+                    f"{segmentations['algoritmo']} · Inercia por k: "
+                    + " · ".join(f"k={k}: {inertia:,.1f}" for k, inertia in segmentations['inercia'].items())
+                )
+            except Exception as e:
+                st.error(f"Error generando gráfico de segmentación: {str(e)}")
+                st.info("No se pudieron generar los datos para el gráfico de segmentación de usuarios")
 
     # ==========================================================
     # ANÁLISIS TEMPORAL AVANZADO
@@ -868,7 +2436,7 @@ if uploaded_file:
             dia_orden = ['Monday', 'Tuesday', 'Wednesday', 'Thursday', 'Friday', 'Saturday', 'Sunday']
             dia_es = ['Lunes', 'Martes', 'Miércoles', 'Jueves', 'Viernes', 'Sábado', 'Domingo']
             
-            trafico_dia = df_processed['dia_semana'].value_counts().reindex(dia_orden)
+            trafico_dia = cube_totals(cube, 'dia_semana').reindex(dia_orden)
             trafico_dia.index = dia_es
             
             fig_dia = px.bar(
@@ -919,7 +2487,7 @@ if uploaded_file:
             </div>
             """, unsafe_allow_html=True)
             # Heatmap de actividad por hora y dispositivo
-            heatmap_data = df_processed.groupby(['hora', 'dispositivo']).size().unstack(fill_value=0)
+            heatmap_data = cube_totals(cube, ['hora', 'dispositivo']).unstack(fill_value=0)
             
             fig_heat = px.imshow(
                 heatmap_data.T,
@@ -1009,7 +2577,7 @@ if uploaded_file:
             {
                 "icon": "🛡️",
                 "title": "Mitigación de Bots",
-                "description": f"Implementar WAF para {metricas['IPs sospechosas']} IPs sospechosas identificadas",
+                "description": f"Implementar WAF para {metricas['IPs bot']} bots y {metricas['IPs sospechosas']} IPs sospechosas identificadas",
                 "priority": "Alta"
             },
             {
@@ -1047,13 +2615,20 @@ if uploaded_file:
         col13, col14, col15 = st.columns(3)
         
         with col13:
-            st.download_button(
-                label="💾 Datos Completos (CSV)",
-                data=df_processed.to_csv(index=False).encode('utf-8'),
-                file_name=f"dgipse_trafico_completo_{datetime.now().strftime('%Y%m%d')}.csv",
-                mime="text/csv",
-                use_container_width=True
-            )
+            # La exportación completa se genera sólo al pedirla, no en cada rerun
+            export_format = st.selectbox("Formato de exportación", list(EXPORT_FORMATS))
+            if st.button("💾 Preparar Datos Completos", use_container_width=True):
+                with st.spinner('📦 Generando archivo de exportación...'):
+                    with export_dataset(df_processed, export_format) as export_file:
+                        export_bytes = export_file.read()
+                extension, mime = EXPORT_FORMATS[export_format]
+                st.download_button(
+                    label=f"⬇️ Descargar Datos Completos ({export_format})",
+                    data=export_bytes,
+                    file_name=f"dgipse_trafico_completo_{datetime.now().strftime('%Y%m%d')}.{extension}",
+                    mime=mime,
+                    use_container_width=True
+                )
         
         with col14:
             st.download_button(
@@ -1116,6 +2691,8 @@ else:
         - Logs Apache/NGINX en formato común
         - Archivos de texto con logs estructurados
         
+        **📦 Parquet/Arrow** - Archivos columnares (Parquet, Feather, Arrow IPC) con las mismas columnas
+        
         ### Comenzar es muy fácil:
         1. **Seleccioná** el tipo de archivo arriba
         2. **Subí** tu archivo usando el selector
@@ -0,0 +1,204 @@
+# ==========================================================
+# FEATURE STORE INCREMENTAL POR IP CON VENTANAS DESLIZANTES
+# ==========================================================
+# Mantiene las features por IP (total_requests, unique_pages, unique_hours) en arreglos
+# compactos que se actualizan con cada lote nuevo, sin recorrer el historial.
+#
+# El tiempo se divide en buckets de BUCKET_SECONDS. Para los conteos distintos cada IP
+# tiene un arreglo de "slots" que guarda el último bucket en que se vio el valor:
+#   - horas: un slot por hora del día (exacto)
+#   - páginas: PAGE_SLOTS slots por hash de la URL (bitmap con linear counting, aproximado)
+# Un valor cuenta dentro de una ventana si su último bucket cae en ella, así que al
+# vencer un bucket sólo se revisan los slots que se tocaron en ese bucket.
+
+import numpy as np
+import pandas as pd
+
+BUCKET_SECONDS = 5 * 60
+# Ventanas disponibles, en buckets (None = todo el historial)
+WINDOWS = {
+    'Última hora': 3600 // BUCKET_SECONDS,
+    'Últimas 24 h': 24 * 3600 // BUCKET_SECONDS,
+    'Últimos 7 días': 7 * 24 * 3600 // BUCKET_SECONDS,
+    'Todo': None
+}
+# Con 64 slots el error de linear counting es bajo hasta unas ~150 páginas por IP
+PAGE_SLOTS = 64
+HOUR_SLOTS = 24
+NEVER = np.iinfo(np.int32).min
+
+def linear_count(occupied, slots):
+    """Estimación de distintos a partir de los slots ocupados de un bitmap (linear counting)"""
+    occupied = np.minimum(occupied, slots - 1)  # un bitmap lleno se satura en el máximo estimable
+    return -slots * np.log1p(-occupied / slots)
+
+class _SlotFamily:
+    """Último bucket visto por (IP, slot) y cantidad de slots vigentes por IP en cada ventana"""
+
+    def __init__(self, n_slots, windows, capacity):
+        self.n_slots = n_slots
+        self.last_seen = np.full((capacity, n_slots), NEVER, dtype=np.int32)
+        self.occupied = {window: np.zeros(capacity, dtype=np.int32) for window in windows}
+        # Pares (IP, slot) cuyo último bucket pasó a ser b, para revisarlos cuando b venza
+        self.touched = {}
+
+    def grow(self, capacity):
+        extra = capacity - len(self.last_seen)
+        self.last_seen = np.vstack([self.last_seen, np.full((extra, self.n_slots), NEVER, dtype=np.int32)])
+        for window, counts in self.occupied.items():
+            self.occupied[window] = np.concatenate([counts, np.zeros(extra, dtype=np.int32)])
+
+    def touch(self, ip_ids, slots, buckets, starts, dirty):
+        """Registra los valores vistos; `starts` da el primer bucket vigente de cada ventana"""
+        order = np.lexsort((buckets, slots, ip_ids))
+        ip_ids, slots, buckets = ip_ids[order], slots[order], buckets[order]
+        # Quedarse con el bucket más reciente de cada par (IP, slot)
+        last = np.ones(len(ip_ids), dtype=bool)
+        last[:-1] = (ip_ids[1:] != ip_ids[:-1]) | (slots[1:] != slots[:-1])
+        ip_ids, slots, buckets = ip_ids[last], slots[last], buckets[last]
+
+        previous = self.last_seen[ip_ids, slots]
+        newer = buckets > previous
+        ip_ids, slots, buckets, previous = ip_ids[newer], slots[newer], buckets[newer], previous[newer]
+        self.last_seen[ip_ids, slots] = buckets
+        for window, start in starts.items():
+            change = (buckets >= start).astype(np.int32) - (previous >= start).astype(np.int32)
+            np.add.at(self.occupied[window], ip_ids, change)
+            dirty[window][ip_ids[change != 0]] = True
+        for bucket in np.unique(buckets):
+            mask = buckets == bucket
+            self.touched.setdefault(int(bucket), []).append((ip_ids[mask], slots[mask]))
+
+    def expire(self, window, bucket, dirty):
+        """Descuenta de la ventana los slots cuyo último bucket es el que acaba de vencer"""
+        for ip_ids, slots in self.touched.get(bucket, []):
+            current = ip_ids[self.last_seen[ip_ids, slots] == bucket]
+            np.subtract.at(self.occupied[window], current, 1)
+            dirty[window][current] = True
+
+    def prune(self, oldest_bucket):
+        for bucket in [bucket for bucket in self.touched if bucket < oldest_bucket]:
+            del self.touched[bucket]
+
+class IPFeatureStore:
+    """Features por IP acumuladas por lotes, consultables por ventana de tiempo.
+
+    El "ahora" es el bucket más reciente visto en los datos (no el reloj del servidor),
+    de modo que las ventanas funcionan igual al reproducir logs viejos.
+    """
+
+    def __init__(self, windows=WINDOWS, capacity=1024):
+        self.windows = dict(windows)
+        self.now = None
+        self._ids = {}
+        self._ips = []
+        self._capacity = capacity
+        self.requests = {window: np.zeros(capacity, dtype=np.int64) for window in self.windows}
+        self._bucket_requests = {}
+        self._pages = _SlotFamily(PAGE_SLOTS, self.windows, capacity)
+        self._hours = _SlotFamily(HOUR_SLOTS, self.windows, capacity)
+        # IPs cuyas features cambiaron en cada ventana desde la última consulta
+        self._dirty = {window: np.zeros(capacity, dtype=bool) for window in self.windows}
+
+    def __len__(self):
+        return len(self._ips)
+
+    def _ip_ids(self, ips):
+        """Ids internos de las IPs del lote, dando de alta las nuevas"""
+        codes, uniques = pd.factorize(ips)
+        ids = np.empty(len(uniques), dtype=np.int64)
+        for i, ip in enumerate(uniques):
+            ip_id = self._ids.get(ip)
+            if ip_id is None:
+                ip_id = self._ids[ip] = len(self._ips)
+                self._ips.append(ip)
+            ids[i] = ip_id
+        if len(self._ips) > self._capacity:
+            self._grow(max(len(self._ips), 2 * self._capacity))
+        return ids[codes]
+
+    def _grow(self, capacity):
+        extra = capacity - self._capacity
+        for window in self.windows:
+            self.requests[window] = np.concatenate([self.requests[window], np.zeros(extra, dtype=np.int64)])
+            self._dirty[window] = np.concatenate([self._dirty[window], np.zeros(extra, dtype=bool)])
+        self._pages.grow(capacity)
+        self._hours.grow(capacity)
+        self._capacity = capacity
+
+    def _starts(self):
+        """Primer bucket vigente de cada ventana según el "ahora" actual"""
+        return {
+            window: NEVER + 1 if length is None else self.now - length + 1
+            for window, length in self.windows.items()
+        }
+
+    def _advance(self, now):
+        """Mueve el "ahora" y descuenta de cada ventana los buckets que vencen"""
+        if self.now is not None and now <= self.now:
+            return
+        if self.now is not None:
+            for window, length in self.windows.items():
+                if length is None:
+                    continue
+                old_start, new_start = self.now - length + 1, now - length + 1
+                for bucket in sorted(b for b in self._bucket_requests if old_start <= b < new_start):
+                    for ip_ids, counts in self._bucket_requests[bucket]:
+                        np.subtract.at(self.requests[window], ip_ids, counts)
+                        self._dirty[window][ip_ids] = True
+                    self._pages.expire(window, bucket, self._dirty)
+                    self._hours.expire(window, bucket, self._dirty)
+        self.now = now
+
+        # Conservar sólo los buckets que todavía pueden vencer de alguna ventana
+        lengths = [length for length in self.windows.values() if length is not None]
+        if lengths:
+            oldest = now - max(lengths) + 1
+            for bucket in [bucket for bucket in self._bucket_requests if bucket < oldest]:
+                del self._bucket_requests[bucket]
+            self._pages.prune(oldest)
+            self._hours.prune(oldest)
+
+    def update(self, batch):
+        """Incorpora un lote preprocesado (columnas IP, fecha, url y hora)"""
+        if batch.empty:
+            return
+        ip_ids = self._ip_ids(batch['IP'].astype(str).to_numpy())
+        buckets = (batch['fecha'].to_numpy().astype('datetime64[s]').astype(np.int64) // BUCKET_SECONDS).astype(np.int32)
+        self._advance(int(buckets.max()))
+        starts = self._starts()
+
+        # Requests por (bucket, IP)
+        keys = pd.DataFrame({'bucket': buckets, 'ip': ip_ids}).value_counts()
+        bucket_keys = keys.index.get_level_values('bucket').to_numpy()
+        ip_keys = keys.index.get_level_values('ip').to_numpy()
+        counts = keys.to_numpy()
+        for bucket in np.unique(bucket_keys):
+            mask = bucket_keys == bucket
+            self._bucket_requests.setdefault(int(bucket), []).append((ip_keys[mask], counts[mask]))
+        for window, start in starts.items():
+            in_window = bucket_keys >= start
+            np.add.at(self.requests[window], ip_keys[in_window], counts[in_window])
+            self._dirty[window][ip_keys[in_window]] = True
+
+        page_slots = (pd.util.hash_array(batch['url'].astype(str).to_numpy()) % PAGE_SLOTS).astype(np.int64)
+        self._pages.touch(ip_ids, page_slots, buckets, starts, self._dirty)
+        self._hours.touch(ip_ids, batch['hora'].to_numpy().astype(np.int64), buckets, starts, self._dirty)
+
+    def window_features(self, window):
+        """(ids, features) de las IPs con actividad en la ventana (columnas base de compute_ip_features)"""
+        n = len(self._ips)
+        ids = np.flatnonzero(self.requests[window][:n] > 0)
+        features = pd.DataFrame({
+            'total_requests': self.requests[window][ids],
+            'unique_pages': np.rint(linear_count(self._pages.occupied[window][ids], PAGE_SLOTS)).astype(np.int64),
+            'unique_hours': self._hours.occupied[window][ids].astype(np.int64)
+        }, index=pd.Index(np.asarray(self._ips, dtype=object)[ids], name='IP'))
+        return ids, features
+
+    def pop_changed(self, window):
+        """Ids de las IPs cuyas features cambiaron en la ventana desde la llamada anterior"""
+        n = len(self._ips)
+        changed = np.flatnonzero(self._dirty[window][:n])
+        self._dirty[window][:n] = False
+        return changed
@@ -0,0 +1,366 @@
+# ==========================================================
+# PARSEO DE LOGS APACHE/NGINX
+# ==========================================================
+# Módulo separado de app.py para que las funciones de parseo sean importables
+# (y serializables) desde los procesos del ProcessPoolExecutor.
+
+import bz2
+import gzip
+import io
+import multiprocessing
+import os
+import re
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+import zstandard
+from pandas.api.types import union_categoricals
+
+# Patrón para logs Apache/NGINX (formato combinado), compilado una sola vez.
+# Con MULTILINE, '^' ancla cada coincidencia al inicio de una línea del bloque.
+# El tamaño puede venir como '-' cuando la respuesta no tiene cuerpo.
+LOG_PATTERN = re.compile(
+    r'^(\S+) - - \[(.*?)\] "(\S+) (\S+) \S+" (\d{3}) (\d+|-) "([^"\n]*)" "([^"\n]*)"',
+    re.MULTILINE
+)
+LOG_FIELDS = ['IP', 'fecha', 'metodo', 'url', 'estado', 'bytes', 'referer_host', 'user_agent']
+LOG_CHUNK_SIZE = 8 * 1024 ** 2
+
+REFERER_HOST_PATTERN = r'^[A-Za-z][A-Za-z0-9+.-]*://(?:[^@/?#]*@)?([^/:?#]+)'
+
+def iter_log_chunks(stream, chunk_size=LOG_CHUNK_SIZE):
+    """Lee un archivo binario en bloques de tamaño fijo, cortando siempre en fin de línea"""
+    remainder = b''
+    while True:
+        chunk = stream.read(chunk_size)
+        if not chunk:
+            break
+        chunk = remainder + chunk
+        cut = chunk.rfind(b'\n')
+        if cut == -1:
+            remainder = chunk
+            continue
+        remainder = chunk[cut + 1:]
+        yield chunk[:cut + 1].decode('utf-8', errors='replace')
+    if remainder:
+        yield remainder.decode('utf-8', errors='replace')
+
+def empty_log_frame():
+    """DataFrame vacío con las columnas y tipos de un log parseado"""
+    return pd.DataFrame({
+        'IP': pd.Series(dtype=object),
+        'fecha': pd.Series(dtype=object),
+        'metodo': pd.Categorical([]),
+        'url': pd.Series(dtype=object),
+        'estado': pd.Series(dtype=np.uint16),
+        'bytes': pd.Series(dtype=np.uint64),
+        'referer_host': pd.Categorical([]),
+        'user_agent': pd.Series(dtype=object)
+    })
+
+def referer_hosts(referers):
+    """Extrae el host de cada referer trabajando sólo sobre los valores únicos ('-' queda vacío)"""
+    codes, uniques = pd.factorize(pd.Series(referers, dtype=object))
+    hosts = pd.Series(uniques, dtype=object).str.extract(REFERER_HOST_PATTERN, expand=False).str.lower()
+    host_codes, categories = pd.factorize(hosts)
+    # Los referers sin host ('-', vacíos) quedan con código -1, es decir NaN
+    host_codes = np.append(host_codes, -1)
+    return pd.Categorical.from_codes(host_codes[codes], categories=categories)
+
+def parse_log_text(text):
+    """Parsea un bloque de líneas de log y devuelve un lote columnar con tipos compactos"""
+    rows = LOG_PATTERN.findall(text)
+    if not rows:
+        return empty_log_frame()
+    ip, timestamp, method, url, status, size, referer, user_agent = zip(*rows)
+    sizes = pd.to_numeric(pd.Series(size, dtype=object), errors='coerce').fillna(0)
+    return pd.DataFrame({
+        'IP': list(ip),
+        'fecha': list(timestamp),
+        'metodo': pd.Categorical(method),
+        'url': list(url),
+        'estado': pd.to_numeric(pd.Series(status, dtype=object)).astype(np.uint16),
+        'bytes': sizes.astype(np.uint64),
+        'referer_host': referer_hosts(referer),
+        'user_agent': list(user_agent)
+    })
+
+def concat_categorical_frames(frames):
+    """Concatena DataFrames unificando las categorías de sus columnas categóricas.
+
+    pd.concat convierte a object las categóricas con categorías distintas; unificarlas
+    antes conserva el tipo compacto en el resultado.
+    """
+    frames = [frame for frame in frames if not frame.empty]
+    if not frames:
+        return pd.DataFrame()
+    if len(frames) > 1:
+        for column in frames[0].columns:
+            if not isinstance(frames[0][column].dtype, pd.CategoricalDtype):
+                continue
+            categories = union_categoricals([frame[column] for frame in frames]).categories
+            for frame in frames:
+                frame[column] = frame[column].cat.set_categories(categories)
+    return pd.concat(frames, ignore_index=True)
+
+def concat_log_batches(batches):
+    """Concatena lotes parseados conservando los tipos compactos"""
+    df = concat_categorical_frames(batches)
+    if df.empty:
+        return empty_log_frame()
+    # uint32 alcanza para respuestas de hasta 4 GB
+    if df['bytes'].max() < 2 ** 32:
+        df['bytes'] = df['bytes'].astype(np.uint32)
+    return df
+
+def parse_log_stream(stream, chunk_size=LOG_CHUNK_SIZE):
+    """Parsea un log Apache/NGINX bloque a bloque sin cargar el archivo completo en memoria"""
+    return concat_log_batches(parse_log_text(text) for text in iter_log_chunks(stream, chunk_size))
+
+# Por debajo de este tamaño el costo de lanzar procesos supera la ganancia
+PARALLEL_PARSE_MIN_BYTES = 32 * 1024 ** 2
+
+class _RangeReader:
+    """Lector binario limitado al rango [start, end) de un archivo"""
+
+    def __init__(self, f, start, end):
+        self._f = f
+        self._f.seek(start)
+        self._remaining = end - start
+
+    def read(self, size):
+        if self._remaining <= 0:
+            return b''
+        data = self._f.read(min(size, self._remaining))
+        self._remaining -= len(data)
+        return data
+
+def split_line_shards(path, n_shards):
+    """Divide un archivo en hasta n rangos (inicio, fin) de bytes cortados en fin de línea"""
+    size = os.path.getsize(path)
+    offsets = [0]
+    with open(path, 'rb') as f:
+        for i in range(1, n_shards):
+            target = size * i // n_shards
+            if target <= offsets[-1]:
+                continue
+            # Avanzar hasta el inicio de la línea siguiente al punto de corte
+            f.seek(target - 1)
+            f.readline()
+            pos = f.tell()
+            if pos >= size:
+                break
+            offsets.append(pos)
+    offsets.append(size)
+    return list(zip(offsets[:-1], offsets[1:]))
+
+def parse_log_file_range(path, start, end):
+    """Parsea el rango [start, end) de un archivo de log (se ejecuta en un proceso worker)"""
+    with open(path, 'rb') as f:
+        return parse_log_stream(_RangeReader(f, start, end))
+
+def parse_log_file_parallel(path, n_workers=None):
+    """Parsea un archivo de log en paralelo repartiéndolo en fragmentos por línea.
+
+    Los resultados de cada fragmento se concatenan en el orden original del archivo.
+    """
+    n_workers = n_workers or os.cpu_count() or 1
+    shards = split_line_shards(path, n_workers)
+    if len(shards) <= 1:
+        with open(path, 'rb') as f:
+            return parse_log_stream(f)
+
+    # 'spawn' evita hacer fork del proceso del servidor de Streamlit, que tiene hilos activos
+    context = multiprocessing.get_context('spawn')
+    with ProcessPoolExecutor(max_workers=len(shards), mp_context=context) as executor:
+        frames = list(executor.map(
+            parse_log_file_range,
+            [path] * len(shards),
+            [start for start, _ in shards],
+            [end for _, end in shards]
+        ))
+    return concat_log_batches(frames)
+
+# ==========================================================
+# LECTURA DE VARIOS ARCHIVOS (LOGS ROTADOS)
+# ==========================================================
+
+# Extensiones de compresión aceptadas (logs rotados por logrotate, exportaciones comprimidas)
+COMPRESSION_EXTENSIONS = {'.gz': 'gzip', '.bz2': 'bz2', '.zst': 'zstd'}
+
+def file_compression(filename):
+    """Códec de compresión según la extensión del archivo (None si no está comprimido)"""
+    return COMPRESSION_EXTENSIONS.get(os.path.splitext(filename.lower())[1])
+
+def decompress_stream(fileobj, compression):
+    """Envuelve un archivo binario en un lector que lo descomprime por streaming"""
+    if compression == 'gzip':
+        return gzip.GzipFile(fileobj=fileobj, mode='rb')
+    if compression == 'bz2':
+        return bz2.BZ2File(fileobj, mode='rb')
+    if compression == 'zstd':
+        # El lector de zstandard no implementa readline: se envuelve en un buffer
+        return io.BufferedReader(zstandard.ZstdDecompressor().stream_reader(fileobj))
+    return fileobj
+
+NDJSON_CHUNK_ROWS = 200_000
+
+def read_ndjson_compact(stream, chunksize=NDJSON_CHUNK_ROWS):
+    """Lee un NDJSON por bloques de filas, guardando cada columna de texto como categórica.
+
+    Nunca se materializa el archivo crudo completo: la memoria pico es un bloque más
+    el resultado compacto acumulado.
+    """
+    frames = []
+    with pd.read_json(stream, lines=True, chunksize=chunksize) as reader:
+        for chunk in reader:
+            for column in chunk.columns[chunk.dtypes == object]:
+                try:
+                    chunk[column] = chunk[column].astype('category')
+                except TypeError:
+                    pass  # valores anidados (listas, objetos) no son hasheables: quedan como object
+            frames.append(chunk)
+    return concat_categorical_frames(frames)
+
+# Lectores disponibles para cada archivo: 'apache', 'csv', 'json' (arreglo) y 'ndjson'
+def read_source_file(path, reader):
+    """Lee un archivo completo con el lector indicado (se ejecuta en un proceso worker)"""
+    with open(path, 'rb') as f:
+        stream = decompress_stream(f, file_compression(path))
+        if reader == 'apache':
+            return parse_log_stream(stream)
+        if reader == 'csv':
+            return pd.read_csv(stream)
+        if reader == 'ndjson':
+            return read_ndjson_compact(stream)
+        return pd.read_json(stream)
+
+# Lectores que se pueden recorrer por bloques (un arreglo JSON hay que leerlo completo)
+STREAMABLE_READERS = ('apache', 'csv', 'ndjson')
+
+def iter_source_chunks(stream, reader, chunksize=NDJSON_CHUNK_ROWS):
+    """Recorre un archivo por bloques de filas crudas, sin materializarlo completo"""
+    if reader == 'apache':
+        for text in iter_log_chunks(stream):
+            batch = parse_log_text(text)
+            if not batch.empty:
+                yield batch
+    elif reader == 'csv':
+        yield from pd.read_csv(stream, chunksize=chunksize)
+    elif reader == 'ndjson':
+        with pd.read_json(stream, lines=True, chunksize=chunksize) as chunks:
+            yield from chunks
+    else:
+        raise ValueError(f"El lector '{reader}' no se puede recorrer por bloques")
+
+def read_source_files(paths, reader, n_workers=None, names=None):
+    """Lee varios archivos en paralelo (un archivo por worker) y los une en un solo DataFrame.
+
+    Cada fila conserva en la columna categórica `archivo` el nombre del archivo de origen.
+    """
+    names = names or [os.path.basename(path) for path in paths]
+    n_workers = min(n_workers or os.cpu_count() or 1, len(paths))
+    if n_workers <= 1:
+        frames = [read_source_file(path, reader) for path in paths]
+    else:
+        context = multiprocessing.get_context('spawn')
+        with ProcessPoolExecutor(max_workers=n_workers, mp_context=context) as executor:
+            frames = list(executor.map(read_source_file, paths, [reader] * len(paths)))
+
+    categories = pd.Index(names).unique()
+    for name, frame in zip(names, frames):
+        frame['archivo'] = pd.Categorical.from_codes(
+            np.full(len(frame), categories.get_loc(name), dtype=np.int32), categories=categories
+        )
+    if reader == 'apache':
+        return concat_log_batches(frames)
+    return concat_categorical_frames(frames)
+
+# ==========================================================
+# SEGUIMIENTO DE LOGS EN VIVO (tail -F)
+# ==========================================================
+
+# Máximo leído por actualización: si el log creció más, el resto se lee en la siguiente
+TAIL_MAX_READ_BYTES = 64 * 1024 ** 2
+
+class LogTailer:
+    """Sigue un archivo de log que crece, como `tail -F`, devolviendo sólo las líneas nuevas.
+
+    Soporta las dos rotaciones de logrotate: por renombre (se termina de leer el archivo
+    viejo y se abre el nuevo desde el principio) y `copytruncate` (el archivo se achica
+    y se vuelve a leer desde el inicio).
+    """
+
+    def __init__(self, path, from_start=False):
+        self.path = path
+        self._file = None
+        self._inode = None
+        self._remainder = b''
+        # Último error al abrir el archivo (None si está abierto o todavía no existe)
+        self.error = None
+        self._open(seek_end=not from_start)
+
+    def _open(self, seek_end=False):
+        try:
+            self._file = open(self.path, 'rb')
+        except FileNotFoundError:
+            self._file = None
+            self.error = None
+            return
+        except OSError as e:
+            # Carpeta, sin permisos de lectura, etc.: se informa y se reintenta en la próxima lectura
+            self._file = None
+            self.error = e
+            return
+        self.error = None
+        self._inode = os.fstat(self._file.fileno()).st_ino
+        if seek_end:
+            self._file.seek(0, os.SEEK_END)
+
+    @property
+    def is_open(self):
+        """Indica si el archivo existe y está abierto"""
+        return self._file is not None
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def _check_rotation(self):
+        """Detecta rotaciones; devuelve lo que quedaba sin leer del archivo anterior"""
+        try:
+            stat = os.stat(self.path)
+        except FileNotFoundError:
+            # Rotado y todavía sin archivo nuevo: se sigue en el próximo intento
+            return b''
+        if stat.st_ino != self._inode:
+            pending = self._file.read()
+            self.close()
+            self._open()
+            # La última línea del archivo viejo no debe pegarse con la primera del nuevo
+            if (self._remainder or pending) and not pending.endswith(b'\n'):
+                pending += b'\n'
+            return pending
+        if stat.st_size < self._file.tell():
+            self._file.seek(0)
+            self._remainder = b''
+        return b''
+
+    def read_new(self, max_bytes=TAIL_MAX_READ_BYTES):
+        """Texto de las líneas completas agregadas desde la última lectura ('' si no hay nuevas)"""
+        if self._file is None:
+            self._open()
+            if self._file is None:
+                return ''
+        data = self._file.read(max_bytes)
+        if len(data) < max_bytes:
+            # Se llegó al final: recién ahora conviene mirar si el archivo rotó
+            data += self._check_rotation()
+            if self._file is not None:
+                data += self._file.read(max_bytes - len(data)) if len(data) < max_bytes else b''
+        data = self._remainder + data
+        cut = data.rfind(b'\n')
+        self._remainder = data[cut + 1:]
+        return data[:cut + 1].decode('utf-8', errors='replace')